@@ -15,14 +15,21 @@ Usage:
 """
 
 import argparse
-import json
 import os
+import random
 import re
+import shutil
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
 
+import ijson
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
 
 SCRIPT_DIR = Path(__file__).parent
 DATA_DIR = SCRIPT_DIR / "data"
@@ -31,62 +38,134 @@ ENV_FILE = SCRIPT_DIR / ".env"
 
 INDEX_URL = "https://api.sec-api.io/bulk/form-4/index.json"
 BASE_URL = "https://api.sec-api.io/bulk/form-4"
+CHUNK_SIZE = 1024 * 1024   # bytes per read/write when streaming a file to disk
+WORKERS = 8                # concurrent downloads in flight at once
+MAX_REQUESTS_PER_SEC = 5   # sustained request rate shared across all workers
+BACKOFF_BASE = 2           # seconds; retry waits are drawn from [0, base * 2**attempt]
+BACKOFF_CAP = 60           # seconds; upper bound on a single retry wait
+
+# One pooled session shared by all workers so TCP/TLS connections are reused.
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=WORKERS,
+                                      pool_maxsize=WORKERS * 2, max_retries=0))
+
+_YM_RE = re.compile(r"(\d{4}-\d{2})")
 
 
 # ---------------------------------------------------------------------------
 # Config
 # ---------------------------------------------------------------------------
 
+@lru_cache(maxsize=1)
+def _env_dict():
+    """Parse .env once into a {key: value} dict (empty if the file is missing)."""
+    if not ENV_FILE.exists():
+        return {}
+    env = {}
+    for line in ENV_FILE.read_text().splitlines():
+        line = line.strip()
+        if line and not line.startswith("#") and "=" in line:
+            key, _, val = line.partition("=")
+            env[key.strip()] = val.strip()
+    return env
+
+
 def load_token():
     """Read SEC_API_TOKEN from .env or environment."""
-    if ENV_FILE.exists():
-        with open(ENV_FILE) as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#") and "=" in line:
-                    key, _, val = line.partition("=")
-                    if key.strip() == "SEC_API_TOKEN" and val.strip():
-                        return val.strip()
-    token = os.environ.get("SEC_API_TOKEN", "")
+    token = _env_dict().get("SEC_API_TOKEN") or os.environ.get("SEC_API_TOKEN", "")
     if not token:
         sys.exit("SEC_API_TOKEN not set. Copy .env.template → .env and add your key.")
     return token
 
 
+# ---------------------------------------------------------------------------
+# Rate limiting
+# ---------------------------------------------------------------------------
+
+class RateLimiter:
+    """Thread-safe token bucket shared by all workers to cap sustained QPS."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+RATE_LIMITER = RateLimiter(MAX_REQUESTS_PER_SEC)
+
+
+def backoff_delay(attempt, resp=None, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Seconds to wait before retry `attempt`: Retry-After if given, else full jitter."""
+    if resp is not None:
+        retry_after = resp.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return int(retry_after)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
 # ---------------------------------------------------------------------------
 # Index
 # ---------------------------------------------------------------------------
 
 def fetch_index(token):
-    """Download the file listing from sec-api.io and save to temp/index.json."""
+    """Download the file listing from sec-api.io and save to temp/index.json.
+
+    The response body is streamed straight to disk and then parsed lazily with
+    ijson, so the full listing is never held in memory as a Python object.
+    """
     TEMP_DIR.mkdir(exist_ok=True)
     print("Fetching index from sec-api.io...")
+    index_path = TEMP_DIR / "index.json"
 
-    resp = requests.get(INDEX_URL, headers={"Authorization": token}, timeout=30)
+    resp = SESSION.get(INDEX_URL, headers={"Authorization": token},
+                       timeout=30, stream=True)
     if resp.status_code == 403:
-        resp = requests.get(f"{INDEX_URL}?token={token}", timeout=30)
-    resp.raise_for_status()
-
-    raw = resp.json()
-    with open(TEMP_DIR / "index.json", "w") as f:
-        json.dump(raw, f, indent=2)
+        resp.close()
+        resp = SESSION.get(f"{INDEX_URL}?token={token}", timeout=30, stream=True)
+    with resp:
+        resp.raise_for_status()
+        resp.raw.decode_content = True
+        with open(index_path, "wb") as f:
+            shutil.copyfileobj(resp.raw, f, length=65536)
 
     # Normalise to a flat list of {"name": ..., "url": ..., "size": ...}
-    if isinstance(raw, list):
-        entries = raw
-    elif isinstance(raw, dict) and "files" in raw:
-        entries = raw["files"]
-    else:
-        sys.exit("Unexpected index format from sec-api.io.")
-
-    files = []
-    for entry in entries:
-        if isinstance(entry, str):
-            files.append({"name": entry, "url": f"{BASE_URL}/{entry}", "size": None})
-        elif isinstance(entry, dict):
-            key = entry.get("key") or entry.get("name") or entry.get("filename", "")
-            url = entry.get("url") or entry.get("link") or f"{BASE_URL}/{key}"
-            files.append({"name": key, "url": url, "size": entry.get("size")})
+    with open(index_path, "rb") as f:
+        head = f.read(64).lstrip()
+        f.seek(0)
+        if head.startswith(b"["):
+            prefix = "item"
+        elif head.startswith(b"{"):
+            prefix = "files.item"
+            # An object without a top-level "files" key is a format we don't know
+            if not any(path == "" and event == "map_key" and value == "files"
+                       for path, event, value in ijson.parse(f)):
+                sys.exit("Unexpected index format from sec-api.io.")
+            f.seek(0)
+        else:
+            sys.exit("Unexpected index format from sec-api.io.")
+
+        files = []
+        for entry in ijson.items(f, prefix, use_float=True):
+            if isinstance(entry, str):
+                files.append({"name": entry, "url": f"{BASE_URL}/{entry}", "size": None})
+            elif isinstance(entry, dict):
+                key = entry.get("key") or entry.get("name") or entry.get("filename", "")
+                url = entry.get("url") or entry.get("link") or f"{BASE_URL}/{key}"
+                files.append({"name": key, "url": url, "size": entry.get("size")})
 
     print(f"  Index has {len(files)} files.")
     return files
@@ -98,54 +177,113 @@ def fetch_index(token):
 
 def extract_year_month(name):
     """Return YYYY-MM from a filename like '2024/2024-01.jsonl.gz'."""
-    m = re.search(r"(\d{4}-\d{2})", name)
+    m = _YM_RE.search(name)
     return m.group(1) if m else None
 
 
+def partial_marker(dest):
+    """Sidecar file that exists while dest is being written."""
+    return Path(str(dest) + ".partial")
+
+
+def etag_sidecar(dest):
+    """Sidecar file holding the server ETag of the last completed download."""
+    return Path(str(dest) + ".etag")
+
+
+def remote_unchanged(url, dest, token):
+    """
+    HEAD url and report whether the local copy at dest still matches it.
+    Compares the ETag against the saved sidecar when both exist, otherwise
+    Content-Length against the local size. Keeps the local copy on HEAD errors.
+    """
+    try:
+        RATE_LIMITER.acquire()
+        resp = SESSION.head(url, headers={"Authorization": token, "Accept-Encoding": "identity"},
+                            timeout=30, allow_redirects=True)
+        resp.raise_for_status()
+    except requests.exceptions.RequestException:
+        return True
+
+    etag = resp.headers.get("ETag")
+    sidecar = etag_sidecar(dest)
+    if etag and sidecar.exists():
+        return sidecar.read_text() == etag
+
+    length = resp.headers.get("Content-Length")
+    if length is None or not length.isdigit() or int(length) != dest.stat().st_size:
+        return False
+    if etag:
+        sidecar.write_text(etag)  # adopt the existing file so later runs compare ETags
+    return True
+
+
 def needs_download(local_path, expected_size, force):
     if force:
         return True
     if not local_path.exists():
         return True
+    if partial_marker(local_path).exists():
+        return True
     if expected_size is not None and local_path.stat().st_size != expected_size:
         return True
     return False
 
 
-def download_file(url, dest, token, max_retries=5):
-    """Stream-download url → dest, via a .tmp file. Cleans up on failure."""
-    tmp = Path(str(dest) + ".tmp")
+def download_file(url, dest, token, expected_size=None, max_retries=5):
+    """Stream-download url → dest in place, pre-sized when the size is known.
+
+    A .partial marker is kept next to dest until the write completes, so an
+    interrupted download is picked up again by needs_download. Cleans up on failure.
+    """
+    marker = partial_marker(dest)
     dest.parent.mkdir(parents=True, exist_ok=True)
+    marker.touch()
 
     for attempt in range(max_retries):
         try:
-            with requests.get(url, headers={"Authorization": token},
-                              timeout=120, stream=True) as resp:
+            RATE_LIMITER.acquire()
+            # Files are already .jsonl.gz; ask for them verbatim and never decode on the wire
+            with SESSION.get(url, headers={"Authorization": token, "Accept-Encoding": "identity"},
+                             timeout=120, stream=True) as resp:
                 if resp.status_code == 429:
-                    wait = (2 ** attempt) * 2
-                    print(f"    Rate limited, retrying in {wait}s...")
+                    wait = backoff_delay(attempt, resp)
+                    print(f"    {dest.name}: rate limited, retrying in {wait:.1f}s...", flush=True)
                     time.sleep(wait)
                     continue
                 resp.raise_for_status()
 
-                with open(tmp, "wb") as f:
-                    for chunk in resp.iter_content(chunk_size=65536):
-                        f.write(chunk)
-
-            tmp.rename(dest)
+                resp.raw.decode_content = False
+                fd = os.open(dest, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o644)
+                with os.fdopen(fd, "wb") as f:
+                    if expected_size and hasattr(os, "posix_fallocate"):
+                        os.posix_fallocate(fd, 0, expected_size)
+                    shutil.copyfileobj(resp.raw, f, length=CHUNK_SIZE)
+                    f.truncate()  # drop any preallocated tail if the body was shorter
+
+            etag = resp.headers.get("ETag")
+            if etag:
+                etag_sidecar(dest).write_text(etag)
+            else:
+                etag_sidecar(dest).unlink(missing_ok=True)
+            marker.unlink()
             return True
 
-        except requests.exceptions.RequestException as e:
+        # Reading resp.raw directly surfaces urllib3 errors (e.g. a body cut short) unwrapped
+        except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError) as e:
             if attempt < max_retries - 1:
-                wait = (2 ** attempt) * 2
-                print(f"    Error: {e}, retrying in {wait}s...")
+                wait = backoff_delay(attempt)
+                print(f"    {dest.name}: error: {e}, retrying in {wait:.1f}s...", flush=True)
                 time.sleep(wait)
             else:
-                print(f"    FAILED after {max_retries} attempts: {e}")
-                if tmp.exists():
-                    tmp.unlink()
+                print(f"    {dest.name}: FAILED after {max_retries} attempts: {e}", flush=True)
+                dest.unlink(missing_ok=True)
+                marker.unlink(missing_ok=True)
                 return False
 
+    # Rate-limited on every attempt: keep the marker only if dest may be half-written
+    if not dest.exists():
+        marker.unlink(missing_ok=True)
     return False
 
 
@@ -167,6 +305,7 @@ def main():
     files = fetch_index(token)
 
     downloaded = skipped = failed = 0
+    to_download = []
 
     for i, entry in enumerate(files, 1):
         ym = extract_year_month(entry["name"])
@@ -183,22 +322,44 @@ def main():
         dest = DATA_DIR / year / f"{ym}.jsonl.gz"
 
         if not needs_download(dest, entry["size"], args.force):
-            skipped += 1
-            print(f"  [{i}/{len(files)}] {ym} — already downloaded, skipping")
+            if entry["size"] is not None:
+                skipped += 1
+                print(f"  [{i}/{len(files)}] {ym} — already downloaded, skipping")
+                continue
+            # Index gives no size to compare: confirm with a HEAD request in the worker
+            to_download.append((ym, dest, entry, True))
             continue
 
-        size_str = f"{entry['size'] / 1024 / 1024:.1f} MB" if entry["size"] else "? MB"
-        print(f"  [{i}/{len(files)}] Downloading {ym} ({size_str})...")
+        to_download.append((ym, dest, entry, False))
 
-        if download_file(entry["url"], dest, token):
-            saved_mb = dest.stat().st_size / 1024 / 1024
-            print(f"    Saved ({saved_mb:.1f} MB)")
-            downloaded += 1
-        else:
-            failed += 1
+    total = len(to_download)
+    print(f"Processing {total} files with {WORKERS} workers...")
 
-        if i < len(files):
-            time.sleep(0.5)
+    def do_download(ym, dest, entry, check_remote):
+        if check_remote and remote_unchanged(entry["url"], dest, token):
+            return "skipped"
+        size_str = f"{entry['size'] / 1024 / 1024:.1f} MB" if entry["size"] else "? MB"
+        print(f"  Downloading {ym} ({size_str})...", flush=True)
+        ok = download_file(entry["url"], dest, token, entry["size"])
+        return "downloaded" if ok else "failed"
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        futures = {executor.submit(do_download, *item): item[:2] for item in to_download}
+        completed = 0
+        for future in as_completed(futures):
+            completed += 1
+            ym, dest = futures[future]
+            result = future.result()
+            if result == "skipped":
+                print(f"  [{completed}/{total}] {ym}: unchanged on server, skipping", flush=True)
+                skipped += 1
+            elif result == "downloaded":
+                saved_mb = dest.stat().st_size / 1024 / 1024
+                print(f"  [{completed}/{total}] {ym}: saved ({saved_mb:.1f} MB)", flush=True)
+                downloaded += 1
+            else:
+                print(f"  [{completed}/{total}] {ym}: FAILED", flush=True)
+                failed += 1
 
     print(f"\nDone: {downloaded} downloaded, {skipped} skipped, {failed} failed")
     if failed:
@@ -22,17 +22,20 @@ Usage:
 """
 
 import argparse
-import csv
+import asyncio
 import json
 import os
+import random
 import sys
 import time
 import zipfile
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
+from functools import lru_cache
+from operator import itemgetter
 from pathlib import Path
 
-import requests
+import aiohttp
 
 SCRIPT_DIR = Path(__file__).parent
 DATA_DIR = SCRIPT_DIR / "data"
@@ -42,26 +45,34 @@ STOCKS_DATA_DIR = SCRIPT_DIR / ".." / "stocks" / "data"
 FAILED_FILE = TEMP_DIR / "failed.json"
 
 FMP_BASE = "https://financialmodelingprep.com/stable/historical-market-capitalization"
-FMP_MAX_DAYS = 5000   # above this we paginate
-FMP_WINDOW = 5000     # calendar days per paginated request
-WORKERS = 20          # concurrent requests in flight at once
+FMP_WINDOW = 5000     # calendar days per request; longer ranges are paginated
+WORKERS = 20          # concurrent tickers (and pooled connections) in flight at once
+MAX_REQUESTS_PER_SEC = 12  # sustained request rate shared across all workers (~750/min)
+BACKOFF_BASE = 2      # seconds; retry waits are drawn from [0, base * 2**attempt]
+BACKOFF_CAP = 60      # seconds; upper bound on a single retry wait
 
 
 # ---------------------------------------------------------------------------
 # Config
 # ---------------------------------------------------------------------------
 
+@lru_cache(maxsize=1)
+def _env_dict():
+    """Parse .env once into a {key: value} dict (empty if the file is missing)."""
+    if not ENV_FILE.exists():
+        return {}
+    env = {}
+    for line in ENV_FILE.read_text().splitlines():
+        line = line.strip()
+        if line and not line.startswith("#") and "=" in line:
+            key, _, val = line.partition("=")
+            env[key.strip()] = val.strip()
+    return env
+
+
 def load_token():
     """Read FMP_API_TOKEN from .env or environment."""
-    if ENV_FILE.exists():
-        with open(ENV_FILE) as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#") and "=" in line:
-                    key, _, val = line.partition("=")
-                    if key.strip() == "FMP_API_TOKEN" and val.strip():
-                        return val.strip()
-    token = os.environ.get("FMP_API_TOKEN", "")
+    token = _env_dict().get("FMP_API_TOKEN") or os.environ.get("FMP_API_TOKEN", "")
     if not token:
         sys.exit("FMP_API_TOKEN not set. Copy .env.template → .env and add your key.")
     return token
@@ -82,31 +93,39 @@ def tickers_from_file(path):
     return sorted(set(tickers))
 
 
+ZIP_TICKER_SUFFIX = "_full_1hour_adjsplitdiv.txt"
+
+
+def _tickers_from_zip(zpath):
+    """Return the tickers named by members of one stocks zip (index read only)."""
+    tickers = set()
+    try:
+        with zipfile.ZipFile(zpath) as zf:
+            for name in zf.namelist():
+                basename = Path(name).name
+                if basename.endswith(ZIP_TICKER_SUFFIX):
+                    ticker = basename[: -len(ZIP_TICKER_SUFFIX)]
+                    if ticker:
+                        tickers.add(ticker)
+    except zipfile.BadZipFile:
+        print(f"  Warning: skipping bad zip: {zpath.name}")
+    return tickers
+
+
 def tickers_from_stocks_zips():
     """
     Discover tickers by listing member filenames inside each stocks zip.
     Each member is named like: AAPL_full_1hour_adjsplitdiv.txt
     No extraction is needed — zipfile.ZipFile.namelist() reads the index only.
+    Zip indexes are read concurrently since each is an independent small read.
     """
     zips = sorted(STOCKS_DATA_DIR.glob("*.zip"))
     if not zips:
         return []
 
-    tickers = []
-    suffix = "_full_1hour_adjsplitdiv.txt"
-    for zpath in zips:
-        try:
-            with zipfile.ZipFile(zpath) as zf:
-                for name in zf.namelist():
-                    basename = Path(name).name
-                    if basename.endswith(suffix):
-                        ticker = basename[: -len(suffix)]
-                        if ticker:
-                            tickers.append(ticker)
-        except zipfile.BadZipFile:
-            print(f"  Warning: skipping bad zip: {zpath.name}")
-
-    return sorted(set(tickers))
+    with ThreadPoolExecutor(max_workers=min(32, len(zips))) as executor:
+        results = executor.map(_tickers_from_zip, zips)
+        return sorted(set().union(*results))
 
 
 # ---------------------------------------------------------------------------
@@ -121,16 +140,56 @@ def load_failed():
 
 
 def save_failed(failed):
+    """Write failed.json atomically (tmp + os.replace) in compact form."""
     TEMP_DIR.mkdir(exist_ok=True)
-    with open(FAILED_FILE, "w") as f:
-        json.dump(failed, f, indent=2)
+    tmp = Path(str(FAILED_FILE) + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(failed, f, separators=(",", ":"))
+    os.replace(tmp, FAILED_FILE)
+
+
+# ---------------------------------------------------------------------------
+# Rate limiting
+# ---------------------------------------------------------------------------
+
+class RateLimiter:
+    """Token bucket shared by all in-flight fetches to cap sustained QPS."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        # Single event loop thread: the check-and-take below never interleaves
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+RATE_LIMITER = RateLimiter(MAX_REQUESTS_PER_SEC)
+
+
+def backoff_delay(attempt, resp=None, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Seconds to wait before retry `attempt`: Retry-After if given, else full jitter."""
+    if resp is not None:
+        retry_after = resp.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return int(retry_after)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
 
 
 # ---------------------------------------------------------------------------
 # FMP API
 # ---------------------------------------------------------------------------
 
-def fetch_page(symbol, token, from_date, to_date):
+async def fetch_page(session, symbol, token, from_date, to_date):
     """
     Fetch one page of market cap data for a single symbol.
     Returns [(date_str, market_cap), ...] or None on unrecoverable error.
@@ -142,22 +201,25 @@ def fetch_page(symbol, token, from_date, to_date):
 
     for attempt in range(3):
         try:
-            with requests.get(url, timeout=60) as resp:
-                status = resp.status_code
+            await RATE_LIMITER.acquire()
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=60)) as resp:
+                status = resp.status
                 if status == 404:
                     return None
-                if status != 429:
+                if status == 429:
+                    wait = backoff_delay(attempt, resp)
+                else:
                     resp.raise_for_status()
-                    data = resp.json()
+                    data = await resp.json(content_type=None)
 
-        except requests.exceptions.RequestException as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
             if attempt < 2:
-                time.sleep(2 ** (attempt + 1))
+                await asyncio.sleep(backoff_delay(attempt))
                 continue
             return None
 
         if status == 429:
-            time.sleep(2 ** (attempt + 1))
+            await asyncio.sleep(wait)
             continue
 
         if isinstance(data, dict):
@@ -177,48 +239,125 @@ def fetch_page(symbol, token, from_date, to_date):
     return None
 
 
-def fetch_market_cap(symbol, token, from_date, to_date):
-    """
-    Fetch full market cap history for a symbol, paginating if the date range
-    exceeds FMP's 5000-record limit.
-    Returns [(date_str, market_cap), ...] sorted ascending, or None on error.
-    """
-    total_days = (to_date - from_date).days
-
-    if total_days <= FMP_MAX_DAYS:
-        return fetch_page(symbol, token, from_date.isoformat(), to_date.isoformat())
-
-    all_rows = []
+def date_windows(from_date, to_date):
+    """Split [from_date, to_date] into FMP_WINDOW-day windows, oldest first."""
+    windows = []
     window_start = from_date
     while window_start <= to_date:
         window_end = min(window_start + timedelta(days=FMP_WINDOW), to_date)
-        rows = fetch_page(symbol, token, window_start.isoformat(), window_end.isoformat())
-        if rows is None:
-            return None
-        all_rows.extend(rows)
+        windows.append((window_start.isoformat(), window_end.isoformat()))
         window_start = window_end + timedelta(days=1)
+    return windows
+
 
-    seen = {}
-    for d, c in all_rows:
-        seen[d] = c
-    return sorted(seen.items())
+async def fetch_market_cap(session, symbol, token, from_date, to_date, out):
+    """
+    Fetch full market cap history for a symbol and stream it to `out` as CSV,
+    paginating if the date range exceeds FMP's 5000-record limit.
+    All windows are requested concurrently over the shared connection pool,
+    then written oldest-first as each completes in order. Each page is sorted
+    on its own, so rows come out in ascending date order without holding the
+    full history.
+    Returns the number of rows written, or None on error.
+    """
+    tasks = [asyncio.ensure_future(fetch_page(session, symbol, token, ws, we))
+             for ws, we in date_windows(from_date, to_date)]
+
+    out.write("date,market_cap\n")
+    seen = set()  # windows are disjoint, so duplicates are not expected; guard cheaply anyway
+    count = 0
+    try:
+        for task in tasks:
+            rows = await task
+            if rows is None:
+                return None
+            # Dates are ISO strings and caps are numbers, so no CSV quoting is ever needed
+            lines = []
+            for date_str, cap in sorted(rows, key=itemgetter(0)):
+                if date_str not in seen:
+                    seen.add(date_str)
+                    lines.append(f"{date_str},{cap}\n")
+            out.write("".join(lines))
+            count += len(lines)
+    finally:
+        for task in tasks:
+            task.cancel()  # no-op for finished pages; stops the rest after an error
+
+    return count
 
 
 # ---------------------------------------------------------------------------
 # CSV write
 # ---------------------------------------------------------------------------
 
-def save_csv(symbol, rows):
-    """Write rows to data/{SYMBOL}.csv atomically via a .tmp file."""
+async def download_csv(session, symbol, token, from_date, to_date):
+    """
+    Stream a symbol's history into data/{SYMBOL}.csv atomically via a .tmp file.
+    Returns the number of rows saved (0 means no data), or None on error.
+    """
     DATA_DIR.mkdir(exist_ok=True)
     dest = DATA_DIR / f"{symbol}.csv"
     tmp = Path(str(dest) + ".tmp")
-    with open(tmp, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["date", "market_cap"])
-        for date_str, cap in rows:
-            writer.writerow([date_str, cap])
-    tmp.rename(dest)
+    try:
+        with open(tmp, "w", newline="") as f:
+            count = await fetch_market_cap(session, symbol, token, from_date, to_date, f)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    if count:
+        tmp.rename(dest)
+    else:
+        tmp.unlink()
+    return count
+
+
+# ---------------------------------------------------------------------------
+# Download loop
+# ---------------------------------------------------------------------------
+
+async def download_all(symbols, token, from_date, to_date, failed_map):
+    """
+    Fetch every symbol on one event loop, at most WORKERS tickers in flight.
+    Writes CSVs and updates failed_map as results arrive.
+    Returns (downloaded, failed) counts.
+    """
+    downloaded = failed = 0
+    total = len(symbols)
+    sem = asyncio.Semaphore(WORKERS)
+
+    connector = aiohttp.TCPConnector(limit=WORKERS)
+    async with aiohttp.ClientSession(connector=connector) as session:
+
+        async def do_fetch(symbol):
+            async with sem:
+                return symbol, await download_csv(session, symbol, token, from_date, to_date)
+
+        completed = 0
+        dirty = False  # failed_map changed since it was last saved
+        for next_done in asyncio.as_completed([do_fetch(sym) for sym in symbols]):
+            completed += 1
+            symbol, count = await next_done
+
+            if not count:
+                status = "NO DATA" if count is not None else "FAILED"
+                print(f"  [{completed}/{total}] {symbol}: {status}", flush=True)
+                failed_map[symbol] = time.strftime("%Y-%m-%dT%H:%M:%S")
+                dirty = True
+                failed += 1
+            else:
+                print(f"  [{completed}/{total}] {symbol}: {count} days", flush=True)
+                if failed_map.pop(symbol, None) is not None:
+                    dirty = True
+                downloaded += 1
+
+            # Persist progress periodically so interruptions don't lose much
+            if dirty and completed % 50 == 0:
+                save_failed(failed_map)
+                dirty = False
+
+    if dirty:
+        save_failed(failed_map)
+    return downloaded, failed
 
 
 # ---------------------------------------------------------------------------
@@ -274,7 +413,7 @@ def main():
         print(f"  Found {len(tickers)} tickers.")
 
     print(f"Date range: {from_date} to {to_date}")
-    print(f"Workers:    {WORKERS} concurrent requests")
+    print(f"Workers:    {WORKERS} concurrent tickers")
     print(f"Output:     {DATA_DIR}/")
     print()
 
@@ -290,37 +429,11 @@ def main():
 
     if skipped:
         print(f"Skipping {skipped} tickers with existing CSVs.")
-    print(f"Downloading {len(to_download)} tickers with {WORKERS} workers...\n")
-
-    downloaded = failed = 0
-    total = len(to_download)
-
-    def do_fetch(symbol):
-        return symbol, fetch_market_cap(symbol, token, from_date, to_date)
-
-    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
-        futures = {executor.submit(do_fetch, sym): sym for sym in to_download}
-        completed = 0
-        for future in as_completed(futures):
-            completed += 1
-            symbol, rows = future.result()
+    print(f"Downloading {len(to_download)} tickers, {WORKERS} at a time...\n")
 
-            if not rows:
-                status = "NO DATA" if rows is not None else "FAILED"
-                print(f"  [{completed}/{total}] {symbol}: {status}", flush=True)
-                failed_map[symbol] = time.strftime("%Y-%m-%dT%H:%M:%S")
-                failed += 1
-            else:
-                save_csv(symbol, rows)
-                print(f"  [{completed}/{total}] {symbol}: {len(rows)} days", flush=True)
-                failed_map.pop(symbol, None)
-                downloaded += 1
-
-            # Persist progress periodically so interruptions don't lose much
-            if completed % 50 == 0 or completed == total:
-                save_failed(failed_map)
+    downloaded, failed = asyncio.run(
+        download_all(to_download, token, from_date, to_date, failed_map))
 
-    save_failed(failed_map)
     print(f"\nDone: {downloaded} downloaded, {skipped} skipped, {failed} failed")
     if failed_map:
         print(f"  {len(failed_map)} total failed tickers — re-run with --retry-failed")
@@ -16,18 +16,21 @@ Usage:
 """
 
 import argparse
+import heapq
+import os
 import shutil
 import sys
 import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from datetime import datetime
 from pathlib import Path
 
 import steps  # noqa: F401 — triggers @step registration via auto-import
 
 from build_common import (
-    OUTPUT_DIR, _disabled_steps, _steps, cleanup_stale_artifacts,
+    OUTPUT_DIR, _disabled_steps, _steps, cleanup_stale_artifacts, clear_manifest,
     finalize_step_order, get_downstream_targets, load_manifest, log,
-    make_connection, save_manifest,
+    make_connection, record_step,
 )
 
 finalize_step_order()
@@ -51,10 +54,8 @@ def determine_steps_to_run(manifest, requested_targets, full_rebuild,
         return [(sid, tgt, fn) for sid, tgt, _, fn in _steps if sid not in skip]
 
     # Determine targets that need rebuilding due to explicit request
-    force_targets = set()
-    for t in requested_targets:
-        force_targets.add(t)
-        force_targets.update(get_downstream_targets(t))
+    force_targets = set(requested_targets).union(
+        *(get_downstream_targets(t) for t in requested_targets))
 
     rebuilt_this_run = set()  # targets rebuilt in this execution
     to_run = []
@@ -84,6 +85,106 @@ def determine_steps_to_run(manifest, requested_targets, full_rebuild,
     return to_run
 
 
+def plan_schedule(steps_to_run):
+    """
+    Work out the run-local DAG for the parallel scheduler.
+    Returns (waits_on, dependents, priority, share), each keyed by step_id:
+      waits_on   — set of step_ids in this run that must finish first
+      dependents — list of step_ids unblocked (in part) by this step
+      priority   — critical-path depth: longest chain of steps from here to a sink
+      share      — width of the step's DAG level; its slice of memory/threads is 1/share
+    A step also waits on earlier steps of the same target, since they write the same outputs.
+    """
+    deps_by_step = {sid: deps for sid, _, deps, _ in _steps}
+    producers = {}  # target -> step_ids in this run that produce it (in order)
+    waits_on, dependents, level = {}, {}, {}
+    for step_id, target, _ in steps_to_run:  # already topologically ordered
+        waits = set(producers.get(target, ()))
+        for dep in deps_by_step[step_id]:
+            waits.update(producers.get(dep, ()))
+        waits_on[step_id] = waits
+        dependents[step_id] = []
+        for w in waits:
+            dependents[w].append(step_id)
+        level[step_id] = max((level[w] + 1 for w in waits), default=0)
+        producers.setdefault(target, []).append(step_id)
+
+    priority = {}
+    for step_id, _, _ in reversed(steps_to_run):
+        priority[step_id] = 1 + max((priority[d] for d in dependents[step_id]), default=0)
+
+    width = {}
+    for lvl in level.values():
+        width[lvl] = width.get(lvl, 0) + 1
+    share = {sid: width[lvl] for sid, lvl in level.items()}
+    return waits_on, dependents, priority, share
+
+
+def run_scheduled(steps_to_run):
+    """
+    Run steps in worker processes as soon as their dependencies finish, longest
+    critical path first. A step is started only while the running steps' shares
+    of memory/threads fit within the budget (or nothing else is running).
+    Returns False if any step failed (running steps finish; nothing new starts).
+    """
+    waits_on, dependents, priority, share = plan_schedule(steps_to_run)
+    order = {sid: i for i, (sid, _, _) in enumerate(steps_to_run)}
+    target_of = {sid: tgt for sid, tgt, _ in steps_to_run}
+    remaining = {sid: len(w) for sid, w in waits_on.items()}
+
+    ready = [(-priority[sid], order[sid], sid) for sid, n in remaining.items() if n == 0]
+    heapq.heapify(ready)
+    running = {}  # future -> step_id
+    used = 0.0  # sum of 1/share over running steps
+    ok = True
+
+    with ProcessPoolExecutor(max_workers=os.cpu_count() or 1, max_tasks_per_child=1) as executor:
+        while running or (ok and ready):
+            deferred = []
+            while ok and ready:
+                item = heapq.heappop(ready)
+                sid = item[2]
+                if running and used + 1 / share[sid] > 1 + 1e-9:
+                    deferred.append(item)
+                    continue
+                log(f"── Step: {sid} (target={target_of[sid]}) ──")
+                running[executor.submit(_run_one, sid, share[sid])] = sid
+                used += 1 / share[sid]
+            for item in deferred:
+                heapq.heappush(ready, item)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                sid = running.pop(future)
+                used -= 1 / share[sid]
+                try:
+                    elapsed = future.result()
+                except Exception as e:
+                    log(f"FAILED: {sid}: {e}")
+                    ok = False
+                    continue
+                record_step(sid, datetime.now().isoformat(), round(elapsed, 1))
+                log(f"  {sid} done in {elapsed:.1f}s")
+                for d in dependents[sid]:
+                    remaining[d] -= 1
+                    if remaining[d] == 0:
+                        heapq.heappush(ready, (-priority[d], order[d], d))
+
+    return ok
+
+
+def _run_one(step_id, share):
+    """Run a single step in a worker process. Returns elapsed seconds."""
+    func = next(fn for sid, _, _, fn in _steps if sid == step_id)
+    t0 = time.time()
+    con = make_connection(share)
+    try:
+        func(con)
+    finally:
+        con.close()
+    return time.time() - t0
+
+
 def run_build(requested_targets, full_rebuild=False, dry_run=False,
               include_disabled=False):
     """Main build execution."""
@@ -110,27 +211,13 @@ def run_build(requested_targets, full_rebuild=False, dry_run=False,
 
     log(f"Running {len(steps_to_run)} step(s)...")
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    if full_rebuild:
+        clear_manifest()
 
-    for step_id, target, func in steps_to_run:
-        log(f"── Step: {step_id} (target={target}) ──")
-        t0 = time.time()
-
-        con = make_connection()
-        try:
-            func(con)
-        except Exception as e:
-            log(f"FAILED: {step_id}: {e}")
-            return False
-        finally:
-            con.close()
-
-        elapsed = time.time() - t0
-        manifest[step_id] = {
-            "completed_at": datetime.now().isoformat(),
-            "elapsed_seconds": round(elapsed, 1),
-        }
-        save_manifest(manifest)
-        log(f"  Done in {elapsed:.1f}s")
+    # Each step runs in its own process (fresh DuckDB memory per step); steps
+    # start as soon as their dependencies finish, longest critical path first.
+    if not run_scheduled(steps_to_run):
+        return False
 
     log("Build complete.")
     install_db_docs()
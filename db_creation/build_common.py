@@ -6,10 +6,15 @@ Constants, logging, step registry, manifest, DuckDB helpers, ticker discovery.
 
 import json
 import os
+import re
 import shutil
+import sqlite3
 import sys
+import threading
 import zipfile
+from collections import deque
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 
 import duckdb
@@ -22,7 +27,9 @@ SCRIPT_DIR = Path(__file__).resolve().parent
 PROJECT_DIR = SCRIPT_DIR.parent
 DATA_SOURCES = PROJECT_DIR / "data_sources"
 OUTPUT_DIR = PROJECT_DIR / "db"
-MANIFEST_FILE = OUTPUT_DIR / ".build_manifest.json"
+MANIFEST_DB = OUTPUT_DIR / ".build_manifest.db"
+MANIFEST_FILE = OUTPUT_DIR / ".build_manifest.json"  # legacy format, migrated on first open
+SNAPSHOT_RE = re.compile(r"^.+\.\d{8}-\d{6}-\d{6}$")  # {table}.{stamp} dirs behind table symlinks
 
 STOCKS_ZIP_DIR = DATA_SOURCES / "stocks" / "data"
 ETFS_ZIP_DIR = DATA_SOURCES / "etfs" / "data"
@@ -30,8 +37,11 @@ MARKET_CAP_DIR = DATA_SOURCES / "market_cap" / "data"
 INSIDER_TRADES_DIR = DATA_SOURCES / "insider_trades" / "data"
 
 PARQUET_SETTINGS = "FORMAT PARQUET, COMPRESSION SNAPPY, ROW_GROUP_SIZE 122880"
+# Aggregate tables (daily, 100-day, 10-day) use larger row groups
+PARQUET_SETTINGS_AGGS = "FORMAT PARQUET, COMPRESSION SNAPPY, ROW_GROUP_SIZE 262144"
 
-DUCKDB_MEMORY_LIMIT = "12GB"
+DUCKDB_MEMORY_LIMIT_GB = 12
+DUCKDB_MEMORY_LIMIT = f"{DUCKDB_MEMORY_LIMIT_GB}GB"
 DUCKDB_THREADS = os.cpu_count() or 4
 
 TICKER_SUFFIX = "_full_1hour_adjsplitdiv.txt"
@@ -61,6 +71,7 @@ def log_progress(current, total, msg):
 _steps = []  # ordered list of (step_id, target, depends_on, func)
 _target_to_steps = {}  # target -> [step_id, ...]
 _disabled_steps = set()  # step_ids that are registered but skipped
+_downstream = {}  # target -> frozenset of transitive downstream targets (set by finalize_step_order)
 
 
 def step(step_id, target, depends_on=(), disabled=False):
@@ -72,6 +83,7 @@ def step(step_id, target, depends_on=(), disabled=False):
     def decorator(func):
         _steps.append((step_id, target, depends_on, func))
         _target_to_steps.setdefault(target, []).append(step_id)
+        get_dependency_graph.cache_clear()
         if disabled:
             _disabled_steps.add(step_id)
         return func
@@ -103,7 +115,6 @@ def finalize_step_order():
                 in_degree[i] += 1
 
     # Kahn's: seed with zero in-degree steps, preserving original order (stable)
-    from collections import deque
     queue = deque(i for i in range(n) if in_degree[i] == 0)
     ordered = []
 
@@ -125,9 +136,16 @@ def finalize_step_order():
     reordered = [_steps[i] for i in ordered]
     _steps[:] = reordered
 
+    # Precompute each target's transitive downstream closure once
+    graph = get_dependency_graph()
+    _downstream.clear()
+    for target in _target_to_steps:
+        _downstream[target] = frozenset(_walk_downstream(graph, target))
+
 
+@lru_cache(maxsize=1)
 def get_dependency_graph():
-    """Build target -> set of targets that depend on it."""
+    """Build target -> set of targets that depend on it (cached; cleared by @step)."""
     dependents = {}
     for _, target, deps, _ in _steps:
         for dep in deps:
@@ -135,13 +153,12 @@ def get_dependency_graph():
     return dependents
 
 
-def get_downstream_targets(target):
-    """Get all targets downstream of a given target (transitive)."""
-    graph = get_dependency_graph()
+def _walk_downstream(graph, target):
+    """BFS over the dependents graph from target (excluding target itself)."""
     visited = set()
-    queue = [target]
+    queue = deque([target])
     while queue:
-        t = queue.pop(0)
+        t = queue.popleft()
         if t in visited:
             continue
         visited.add(t)
@@ -151,24 +168,89 @@ def get_downstream_targets(target):
     return visited
 
 
+def get_downstream_targets(target):
+    """Get all targets downstream of a given target (transitive)."""
+    return _downstream.get(target, frozenset())
+
+
 # ---------------------------------------------------------------------------
 # Manifest
 # ---------------------------------------------------------------------------
 
+_manifest_cache = {"stamp": None, "data": None}  # load_manifest memo, keyed on DB (mtime_ns, size)
 
-def load_manifest():
+
+def _open_manifest():
+    """Open the manifest DB, creating it (and migrating a legacy JSON manifest) if needed."""
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(MANIFEST_DB))
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS steps (
+            step_id TEXT PRIMARY KEY,
+            completed_at TEXT NOT NULL,
+            elapsed_seconds REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
     if MANIFEST_FILE.exists():
         with open(MANIFEST_FILE) as f:
-            return json.load(f)
-    return {}
+            legacy = json.load(f)
+        conn.executemany(
+            "INSERT OR IGNORE INTO steps VALUES (?, ?, ?)",
+            [(sid, info["completed_at"], info["elapsed_seconds"]) for sid, info in legacy.items()],
+        )
+        conn.commit()
+        MANIFEST_FILE.unlink()
+    return conn
 
 
-def save_manifest(manifest):
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    tmp = Path(str(MANIFEST_FILE) + ".tmp")
-    with open(tmp, "w") as f:
-        json.dump(manifest, f, indent=2)
-    tmp.rename(MANIFEST_FILE)
+def _manifest_stamp():
+    """(mtime_ns, size) of the manifest DB, or None if it doesn't exist."""
+    try:
+        st = MANIFEST_DB.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def load_manifest():
+    """Return {step_id: {completed_at, elapsed_seconds}} for all completed steps.
+
+    The result is cached until the manifest DB changes on disk or is written
+    through record_step()/clear_manifest(); treat it as read-only.
+    """
+    if not MANIFEST_DB.exists() and not MANIFEST_FILE.exists():
+        return {}
+    stamp = _manifest_stamp()
+    if stamp is not None and stamp == _manifest_cache["stamp"]:
+        return _manifest_cache["data"]
+    conn = _open_manifest()
+    rows = conn.execute("SELECT step_id, completed_at, elapsed_seconds FROM steps").fetchall()
+    conn.close()
+    data = {sid: {"completed_at": completed_at, "elapsed_seconds": elapsed}
+            for sid, completed_at, elapsed in rows}
+    _manifest_cache["stamp"] = _manifest_stamp()
+    _manifest_cache["data"] = data
+    return data
+
+
+def record_step(step_id, completed_at, elapsed_seconds):
+    """Upsert one completed step — a single-row write, not a full manifest rewrite."""
+    conn = _open_manifest()
+    conn.execute("INSERT OR REPLACE INTO steps VALUES (?, ?, ?)",
+                 (step_id, completed_at, elapsed_seconds))
+    conn.commit()
+    conn.close()
+    _manifest_cache["stamp"] = None
+
+
+def clear_manifest():
+    """Forget all completed steps (used by --full)."""
+    conn = _open_manifest()
+    conn.execute("DELETE FROM steps")
+    conn.commit()
+    conn.close()
+    _manifest_cache["stamp"] = None
 
 
 # ---------------------------------------------------------------------------
@@ -177,13 +259,17 @@ def save_manifest(manifest):
 
 
 def cleanup_stale_artifacts():
-    """Remove all .tmp files/dirs anywhere under OUTPUT_DIR, plus top-level _old/_building/_ artifacts."""
+    """Remove all .tmp files/dirs anywhere under OUTPUT_DIR, plus top-level _old/_building/_ artifacts
+    and directory snapshots no longer referenced by their table symlink."""
     if not OUTPUT_DIR.exists():
         return
-    # Recursively remove any .tmp file or directory anywhere in db/
-    for item in OUTPUT_DIR.rglob("*.tmp"):
+    # Recursively remove any .tmp file or directory anywhere in db/ (collected first:
+    # the same file can be reached both through a table symlink and its snapshot dir)
+    for item in list(OUTPUT_DIR.rglob("*.tmp")):
+        if not item.is_symlink() and not item.exists():
+            continue
         log(f"Cleaning stale artifact: {item.relative_to(OUTPUT_DIR)}")
-        if item.is_dir():
+        if item.is_dir() and not item.is_symlink():
             shutil.rmtree(item)
         else:
             item.unlink()
@@ -191,10 +277,47 @@ def cleanup_stale_artifacts():
     for item in OUTPUT_DIR.iterdir():
         if item.name.endswith("_old") or item.name.endswith("_building") or item.name.startswith("_"):
             log(f"Cleaning stale artifact: {item.name}")
-            if item.is_dir():
+            if item.is_dir() and not item.is_symlink():
                 shutil.rmtree(item)
             else:
                 item.unlink()
+    # Snapshot dirs ({table}.{stamp}) left behind by an interrupted swap or background delete
+    live = {os.readlink(item) for item in OUTPUT_DIR.iterdir() if item.is_symlink()}
+    for item in OUTPUT_DIR.iterdir():
+        if (SNAPSHOT_RE.match(item.name) and item.name not in live
+                and item.is_dir() and not item.is_symlink()):
+            log(f"Cleaning stale artifact: {item.name}")
+            shutil.rmtree(item)
+
+
+def swap_in_dir(building_dir, out_dir):
+    """Publish building_dir as out_dir with an atomic symlink swap.
+
+    building_dir is renamed to a timestamped snapshot ({name}.{stamp}) and
+    out_dir becomes a relative symlink to it, replaced in one os.replace().
+    The previous snapshot is deleted on a background thread, so the step
+    doesn't wait on rmtree of thousands of partition files.
+    """
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    snapshot = out_dir.with_name(f"{out_dir.name}.{stamp}")
+    building_dir.rename(snapshot)
+
+    stale = None
+    if out_dir.is_symlink():
+        stale = out_dir.parent / os.readlink(out_dir)
+    elif out_dir.exists():
+        # Pre-symlink layout: a real directory has to be moved aside first
+        stale = Path(str(out_dir) + "_old")
+        out_dir.rename(stale)
+
+    link_tmp = Path(str(out_dir) + ".link.tmp")
+    if link_tmp.is_symlink() or link_tmp.exists():
+        link_tmp.unlink()
+    os.symlink(snapshot.name, link_tmp)
+    os.replace(link_tmp, out_dir)
+
+    if stale is not None:
+        threading.Thread(target=shutil.rmtree, args=(stale,), kwargs={"ignore_errors": True}).start()
 
 
 # ---------------------------------------------------------------------------
@@ -202,19 +325,51 @@ def cleanup_stale_artifacts():
 # ---------------------------------------------------------------------------
 
 
-def make_connection():
+def make_connection(share=1):
+    """Open an in-memory DuckDB connection.
+
+    `share` is the number of steps running concurrently; memory and threads
+    are split evenly between them so parallel steps don't oversubscribe.
+    """
     con = duckdb.connect(":memory:")
-    con.execute(f"SET memory_limit = '{DUCKDB_MEMORY_LIMIT}'")
-    con.execute(f"SET threads = {DUCKDB_THREADS}")
+    if share <= 1:
+        con.execute(f"SET memory_limit = '{DUCKDB_MEMORY_LIMIT}'")
+        con.execute(f"SET threads = {DUCKDB_THREADS}")
+    else:
+        con.execute(f"SET memory_limit = '{DUCKDB_MEMORY_LIMIT_GB * 1024 // share}MB'")
+        con.execute(f"SET threads = {max(1, DUCKDB_THREADS // share)}")
+    # Every write that needs an order says ORDER BY; let everything else stream in parallel
+    con.execute("SET preserve_insertion_order = false")
     return con
 
 
-def verify_parquet(path, min_rows=1):
-    """Verify a parquet file/directory has at least min_rows rows."""
+def create_ticker_enum(con, source):
+    """Create ticker_enum on `con` from the distinct tickers in `source` (a table or read_parquet(...)).
+
+    Casting ticker to the ENUM makes sorts, window partitions and GROUP BYs
+    compare small integers instead of strings. Values are added in sorted order,
+    so ORDER BY on the ENUM matches ORDER BY on the VARCHAR, and COPY writes the
+    column back out as a plain string.
+    """
+    con.execute(f"""
+        CREATE TYPE ticker_enum AS ENUM (
+            SELECT DISTINCT ticker FROM {source} WHERE ticker IS NOT NULL ORDER BY ticker
+        )
+    """)
+
+
+def verify_parquet(path, min_rows=1, rows_written=None):
+    """
+    Verify a parquet file/glob has at least min_rows rows. The count comes from
+    the file footers, so no row groups are scanned. Pass rows_written (the count
+    returned by the COPY) to also check the footers agree with what was written.
+    """
     con = duckdb.connect(":memory:")
-    result = con.execute(f"SELECT COUNT(*) FROM read_parquet('{path}')").fetchone()
+    result = con.execute(f"SELECT COALESCE(SUM(num_rows), 0) FROM parquet_file_metadata('{path}')").fetchone()
     con.close()
     count = result[0]
+    if rows_written is not None and count != rows_written:
+        raise RuntimeError(f"Verification failed: {path} has {count} rows but COPY wrote {rows_written}")
     if count < min_rows:
         raise RuntimeError(f"Verification failed: {path} has {count} rows (expected >= {min_rows})")
     return count
@@ -225,19 +380,20 @@ def verify_parquet(path, min_rows=1):
 # ---------------------------------------------------------------------------
 
 
-def discover_tickers_from_zips(zip_dir):
-    """Discover tickers by reading ZIP file indexes (no extraction)."""
-    tickers = {}
-    zips = sorted(zip_dir.glob("*.zip"))
-    for zpath in zips:
+def iter_zip_tickers(zip_dir):
+    """Yield (zip_path, [ticker, ...]) for each ZIP by reading its index (no extraction)."""
+    for zpath in sorted(zip_dir.glob("*.zip")):
         try:
             with zipfile.ZipFile(zpath) as zf:
-                for name in zf.namelist():
-                    basename = Path(name).name
-                    if basename.endswith(TICKER_SUFFIX):
-                        ticker = basename[:-len(TICKER_SUFFIX)]
-                        if ticker:
-                            tickers[ticker] = zpath
+                names = zf.namelist()
         except zipfile.BadZipFile:
             log(f"Warning: skipping bad zip: {zpath.name}")
-    return tickers
+            continue
+        tickers = []
+        for name in names:
+            basename = Path(name).name
+            if basename.endswith(TICKER_SUFFIX):
+                ticker = basename[:-len(TICKER_SUFFIX)]
+                if ticker:
+                    tickers.append(ticker)
+        yield zpath, tickers
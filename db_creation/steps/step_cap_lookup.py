@@ -1,9 +1,8 @@
 """Step 12: Build cap_lookup — daily_aggs_enriched sorted by (trading_day_num, ticker) for cap-range scans."""
 
 import shutil
-from pathlib import Path
 
-from build_common import OUTPUT_DIR, PARQUET_SETTINGS, log, step, verify_parquet
+from build_common import OUTPUT_DIR, PARQUET_SETTINGS, log, step, swap_in_dir, verify_parquet
 
 
 @step("cap_lookup_v2", target="cap_lookup", depends_on=("daily_aggs_enriched",))
@@ -41,28 +40,22 @@ def build_cap_lookup(con):
         out_dir.mkdir(parents=True, exist_ok=True)
         out_path = out_dir / "data.parquet"
 
-        con.execute(f"""
+        written = con.execute(f"""
             COPY (
                 SELECT day, ticker, cap, close, trading_day_num, cum_close
                 FROM _cap_lookup
                 WHERE YEAR(day) = {year}
                 ORDER BY trading_day_num, ticker
             ) TO '{out_path}' ({PARQUET_SETTINGS})
-        """)
+        """).fetchone()[0]
 
-        count = verify_parquet(str(out_path))
+        count = verify_parquet(str(out_path), rows_written=written)
         total_rows += count
         log(f"  [{yr_idx + 1}/{total_years}] year={year}: {count:,} rows")
 
     con.execute("DROP TABLE _cap_lookup")
 
-    # Atomic swap
-    if lookup_dir.exists():
-        stale = Path(str(lookup_dir) + "_old")
-        lookup_dir.rename(stale)
-        building_dir.rename(lookup_dir)
-        shutil.rmtree(stale)
-    else:
-        building_dir.rename(lookup_dir)
+    # Atomic swap (symlink; old snapshot deleted in the background)
+    swap_in_dir(building_dir, lookup_dir)
 
     log(f"  Wrote {total_rows:,} total cap_lookup rows")
@@ -1,15 +1,15 @@
 """Step 3: Aggregate hourly prices into daily OHLCV + component sums (Hive-partitioned by year)."""
 
 import shutil
-from pathlib import Path
 
-from build_common import OUTPUT_DIR, PARQUET_SETTINGS, log, step, verify_parquet
+from build_common import (
+    OUTPUT_DIR, PARQUET_SETTINGS_AGGS, create_ticker_enum, log, step, swap_in_dir, verify_parquet,
+)
 
 
 @step("daily_aggs_v2", target="daily_aggs", depends_on=("prices",), disabled=True)
 def build_daily_aggs(con):
     """Aggregate hourly prices into daily OHLCV + component sums, partitioned by year."""
-    prices_pattern = str(OUTPUT_DIR / "prices" / "**" / "*.parquet")
     daily_dir = OUTPUT_DIR / "daily_aggs"
     building_dir = OUTPUT_DIR / "daily_aggs_building"
 
@@ -20,15 +20,14 @@ def build_daily_aggs(con):
 
     log("Building daily aggregates from all price data...")
 
-    # Get distinct years from prices
-    years = [r[0] for r in con.execute(f"""
-        SELECT DISTINCT year
-        FROM read_parquet('{prices_pattern}', hive_partitioning=true)
-        ORDER BY year
-    """).fetchall()]
+    # Years come from the Hive partition directory names; no need to scan the files.
+    # One sorted COPY per year: PARTITION_BY would be a single statement, but it
+    # does not keep rows in ORDER BY order within each output file.
+    years = sorted(int(d.name.split("=")[1]) for d in (OUTPUT_DIR / "prices").glob("year=*"))
 
     total_years = len(years)
     total_rows = 0
+    create_ticker_enum(con, f"read_parquet('{OUTPUT_DIR / 'prices' / '**' / '*.parquet'}')")
 
     for yr_idx, year in enumerate(years):
         year_prices = str(OUTPUT_DIR / "prices" / f"year={year}" / "*.parquet")
@@ -36,17 +35,18 @@ def build_daily_aggs(con):
         out_dir.mkdir(parents=True, exist_ok=True)
         out_path = out_dir / "data.parquet"
 
-        con.execute(f"""
+        written = con.execute(f"""
             COPY (
                 SELECT
                     ticker,
                     CAST(ts AS DATE) AS day,
 
                     -- Day's OHLCV (first/last by ts, max/min/sum)
-                    FIRST(open ORDER BY ts) AS open,
+                    -- Wrapped in a struct so a NULL open/close is returned, not skipped (as FIRST/LAST did)
+                    ARG_MIN({{'v': open}}, ts).v AS open,
                     MAX(high) AS high,
                     MIN(low) AS low,
-                    LAST(close ORDER BY ts) AS close,
+                    ARG_MAX({{'v': close}}, ts).v AS close,
                     SUM(volume)::BIGINT AS volume,
 
                     -- Component sums
@@ -57,28 +57,25 @@ def build_daily_aggs(con):
                     SUM(volume)::BIGINT AS sum_volume,
                     COUNT(*)::UTINYINT AS cnt
 
-                FROM read_parquet('{year_prices}')
+                FROM (
+                    SELECT * REPLACE (ticker::ticker_enum AS ticker)
+                    FROM read_parquet('{year_prices}')
+                )
                 GROUP BY ticker, CAST(ts AS DATE)
                 ORDER BY ticker, day
-            ) TO '{out_path}' ({PARQUET_SETTINGS})
-        """)
+            ) TO '{out_path}' ({PARQUET_SETTINGS_AGGS})
+        """).fetchone()[0]
 
-        count = verify_parquet(str(out_path))
+        count = verify_parquet(str(out_path), rows_written=written)
         total_rows += count
         log(f"  [{yr_idx + 1}/{total_years}] year={year}: {count:,} rows")
 
-    # Swap in the final directory
+    # Swap in the final directory (symlink; old snapshot deleted in the background)
     # Remove stale single-file artifact if it exists from prior version
     old_file = OUTPUT_DIR / "daily_aggs.parquet"
     if old_file.exists():
         old_file.unlink()
 
-    if daily_dir.exists():
-        stale = Path(str(daily_dir) + "_old")
-        daily_dir.rename(stale)
-        building_dir.rename(daily_dir)
-        shutil.rmtree(stale)
-    else:
-        building_dir.rename(daily_dir)
+    swap_in_dir(building_dir, daily_dir)
 
     log(f"  Wrote {total_rows:,} total daily agg rows")
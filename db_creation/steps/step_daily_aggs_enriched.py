@@ -1,10 +1,9 @@
 """Step 8: Build daily_aggs_enriched — daily OHLCV with market cap and cumulative sums."""
 
 import shutil
-from pathlib import Path
 
 from build_common import (
-    MARKET_CAP_DIR, OUTPUT_DIR, PARQUET_SETTINGS, log, step, verify_parquet,
+    MARKET_CAP_DIR, OUTPUT_DIR, PARQUET_SETTINGS, log, step, swap_in_dir, verify_parquet,
 )
 
 
@@ -29,10 +28,11 @@ def build_daily_aggs_enriched(con):
         SELECT
             ticker,
             CAST(ts AS DATE) AS day,
-            FIRST(open ORDER BY ts) AS open,
+            -- Wrapped in a struct so a NULL open/close is returned, not skipped (as FIRST/LAST did)
+            ARG_MIN({{'v': open}}, ts).v AS open,
             MAX(high) AS high,
             MIN(low) AS low,
-            LAST(close ORDER BY ts) AS close,
+            ARG_MAX({{'v': close}}, ts).v AS close,
             SUM(volume)::BIGINT AS volume
         FROM read_parquet('{prices_pattern}', hive_partitioning=true)
         GROUP BY ticker, CAST(ts AS DATE)
@@ -43,17 +43,22 @@ def build_daily_aggs_enriched(con):
 
     log("Loading market cap data...")
 
+    # Ticker is derived in a subquery so the filename split runs once per row,
+    # not again inside each WHERE predicate that references the alias
     con.execute(f"""
         CREATE TABLE _market_cap AS
-        SELECT
-            replace(string_split(filename, '/')[-1], '.csv', '') AS ticker,
-            CAST(date AS DATE) AS day,
-            CAST(market_cap AS BIGINT) AS cap
-        FROM read_csv(
-            '{csv_pattern}',
-            header=true,
-            columns={{'date': 'DATE', 'market_cap': 'BIGINT'}},
-            filename=true
+        SELECT ticker, day, cap
+        FROM (
+            SELECT
+                replace(string_split(filename, '/')[-1], '.csv', '') AS ticker,
+                CAST(date AS DATE) AS day,
+                CAST(market_cap AS BIGINT) AS cap
+            FROM read_csv(
+                '{csv_pattern}',
+                header=true,
+                columns={{'date': 'DATE', 'market_cap': 'BIGINT'}},
+                filename=true
+            )
         )
         WHERE ticker != ''
           AND ticker IN (SELECT ticker FROM read_parquet('{tickers_path}'))
@@ -109,7 +114,7 @@ def build_daily_aggs_enriched(con):
         out_dir.mkdir(parents=True, exist_ok=True)
         out_path = out_dir / "data.parquet"
 
-        con.execute(f"""
+        written = con.execute(f"""
             COPY (
                 SELECT
                     ticker, day, open, high, low, close, volume, cap,
@@ -118,21 +123,15 @@ def build_daily_aggs_enriched(con):
                 WHERE YEAR(day) = {year}
                 ORDER BY ticker, trading_day_num
             ) TO '{out_path}' ({PARQUET_SETTINGS})
-        """)
+        """).fetchone()[0]
 
-        count = verify_parquet(str(out_path))
+        count = verify_parquet(str(out_path), rows_written=written)
         total_rows += count
         log(f"  [{yr_idx + 1}/{total_years}] year={year}: {count:,} rows")
 
     con.execute("DROP TABLE _enriched")
 
-    # Atomic swap
-    if enriched_dir.exists():
-        stale = Path(str(enriched_dir) + "_old")
-        enriched_dir.rename(stale)
-        building_dir.rename(enriched_dir)
-        shutil.rmtree(stale)
-    else:
-        building_dir.rename(enriched_dir)
+    # Atomic swap (symlink; old snapshot deleted in the background)
+    swap_in_dir(building_dir, enriched_dir)
 
     log(f"  Wrote {total_rows:,} total daily_aggs_enriched rows")
\ No newline at end of file
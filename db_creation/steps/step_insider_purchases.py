@@ -1,10 +1,9 @@
 """Step 9: Build insider_purchases — SEC Form 4 open-market purchases by filing date."""
 
 import shutil
-from pathlib import Path
 
 from build_common import (
-    INSIDER_TRADES_DIR, OUTPUT_DIR, PARQUET_SETTINGS, log, step, verify_parquet,
+    INSIDER_TRADES_DIR, OUTPUT_DIR, PARQUET_SETTINGS, log, step, swap_in_dir, verify_parquet,
 )
 
 
@@ -85,7 +84,7 @@ def build_insider_purchases(con):
         out_dir.mkdir(parents=True, exist_ok=True)
         out_path = out_dir / "data.parquet"
 
-        con.execute(f"""
+        written = con.execute(f"""
             COPY (
                 SELECT
                     filing_date, ticker, insider_cik, total_value, shares,
@@ -95,21 +94,15 @@ def build_insider_purchases(con):
                 WHERE YEAR(filing_date) = {year}
                 ORDER BY trading_day_num, ticker
             ) TO '{out_path}' ({PARQUET_SETTINGS})
-        """)
+        """).fetchone()[0]
 
-        count = verify_parquet(str(out_path))
+        count = verify_parquet(str(out_path), rows_written=written)
         total_rows += count
         log(f"  [{yr_idx + 1}/{total_years}] year={year}: {count:,} rows")
 
     con.execute("DROP TABLE _purchases_tdn")
 
-    # Atomic swap
-    if purchases_dir.exists():
-        stale = Path(str(purchases_dir) + "_old")
-        purchases_dir.rename(stale)
-        building_dir.rename(purchases_dir)
-        shutil.rmtree(stale)
-    else:
-        building_dir.rename(purchases_dir)
+    # Atomic swap (symlink; old snapshot deleted in the background)
+    swap_in_dir(building_dir, purchases_dir)
 
     log(f"  Wrote {total_rows:,} total insider_purchases rows")
@@ -16,48 +16,62 @@ def build_insider_trades(con):
 
     log("Building insider_trades from JSONL.GZ files...")
 
-    con.execute(f"""
+    # Stage 1: decode + unnest every filing into a temp table (no ticker filter, no sort)
+    con.execute("""
+        CREATE TEMP TABLE _tx AS
+        SELECT
+            upper(trim(issuer.tradingSymbol)) AS ticker,
+            COALESCE(tx.transactionDate, periodOfReport) AS trade_date,
+            tx.coding.code AS tx_code,
+            CAST(tx.amounts.shares AS FLOAT) AS shares,
+            CAST(tx.amounts.shares * tx.amounts.pricePerShare AS FLOAT) AS total_value,
+            CASE
+                WHEN tx.amounts.acquiredDisposedCode IN ('A', 'D')
+                    THEN tx.amounts.acquiredDisposedCode
+                WHEN tx.coding.code = 'P' THEN 'A'
+                ELSE 'D'
+            END AS acquired_disposed,
+            CAST(tx.postTransactionAmounts.sharesOwnedFollowingTransaction AS FLOAT) AS shares_after,
+            CASE
+                WHEN tx.ownershipNature.directOrIndirectOwnership IN ('D', 'I')
+                    THEN tx.ownershipNature.directOrIndirectOwnership
+                ELSE 'D'
+            END AS ownership_type,
+            COALESCE(reportingOwner.relationship.isDirector, false) AS is_director,
+            COALESCE(reportingOwner.relationship.isOfficer, false) AS is_officer,
+            COALESCE(reportingOwner.relationship.isTenPercentOwner, false) AS is_ten_pct_owner,
+            reportingOwner.name AS insider_name,
+            reportingOwner.cik AS insider_cik,
+            reportingOwner.relationship.officerTitle AS officer_title
+        FROM read_json(
+            ?,
+            format='newline_delimited',
+            ignore_errors=true
+        )
+        , LATERAL UNNEST(nonDerivativeTable.transactions) AS t(tx)
+        WHERE tx.coding.code IN ('P', 'S')
+          AND tx.amounts.shares IS NOT NULL
+          AND upper(trim(issuer.tradingSymbol)) != ''
+          AND COALESCE(tx.transactionDate, periodOfReport) IS NOT NULL
+          AND EXTRACT(YEAR FROM COALESCE(tx.transactionDate, periodOfReport)) BETWEEN 2000 AND 2026
+    """, [jsonl_pattern])
+    tx_count = con.execute("SELECT COUNT(*) FROM _tx").fetchone()[0]
+    log(f"  {tx_count:,} P/S transactions decoded")
+
+    # Stage 2: whitelist tickers with a hash SEMI JOIN, sort, write one file
+    con.execute("CREATE TEMP TABLE _valid_tickers AS SELECT ticker FROM read_parquet(?)",
+                [str(OUTPUT_DIR / "tickers.parquet")])
+    written = con.execute(f"""
         COPY (
-            SELECT
-                upper(trim(issuer.tradingSymbol)) AS ticker,
-                COALESCE(tx.transactionDate, periodOfReport) AS trade_date,
-                tx.coding.code AS tx_code,
-                CAST(tx.amounts.shares AS FLOAT) AS shares,
-                CAST(tx.amounts.shares * tx.amounts.pricePerShare AS FLOAT) AS total_value,
-                CASE
-                    WHEN tx.amounts.acquiredDisposedCode IN ('A', 'D')
-                        THEN tx.amounts.acquiredDisposedCode
-                    WHEN tx.coding.code = 'P' THEN 'A'
-                    ELSE 'D'
-                END AS acquired_disposed,
-                CAST(tx.postTransactionAmounts.sharesOwnedFollowingTransaction AS FLOAT) AS shares_after,
-                CASE
-                    WHEN tx.ownershipNature.directOrIndirectOwnership IN ('D', 'I')
-                        THEN tx.ownershipNature.directOrIndirectOwnership
-                    ELSE 'D'
-                END AS ownership_type,
-                COALESCE(reportingOwner.relationship.isDirector, false) AS is_director,
-                COALESCE(reportingOwner.relationship.isOfficer, false) AS is_officer,
-                COALESCE(reportingOwner.relationship.isTenPercentOwner, false) AS is_ten_pct_owner,
-                reportingOwner.name AS insider_name,
-                reportingOwner.cik AS insider_cik,
-                reportingOwner.relationship.officerTitle AS officer_title
-            FROM read_json(
-                '{jsonl_pattern}',
-                format='newline_delimited',
-                ignore_errors=true
-            )
-            , LATERAL UNNEST(nonDerivativeTable.transactions) AS t(tx)
-            WHERE tx.coding.code IN ('P', 'S')
-              AND tx.amounts.shares IS NOT NULL
-              AND upper(trim(issuer.tradingSymbol)) != ''
-              AND upper(trim(issuer.tradingSymbol)) IN (SELECT ticker FROM read_parquet('{OUTPUT_DIR / "tickers.parquet"}'))
-              AND COALESCE(tx.transactionDate, periodOfReport) IS NOT NULL
-              AND EXTRACT(YEAR FROM COALESCE(tx.transactionDate, periodOfReport)) BETWEEN 2000 AND 2026
-            ORDER BY ticker, trade_date
+            SELECT tx.*
+            FROM _tx tx
+            SEMI JOIN _valid_tickers v USING (ticker)
+            ORDER BY tx.ticker, tx.trade_date
         ) TO '{tmp}' ({PARQUET_SETTINGS})
-    """)
+    """).fetchone()[0]
+    con.execute("DROP TABLE _tx")
+    con.execute("DROP TABLE _valid_tickers")
     tmp.rename(dest)
 
-    count = verify_parquet(str(dest))
+    count = verify_parquet(str(dest), rows_written=written)
     log(f"  Wrote {count:,} rows to insider_trades.parquet")
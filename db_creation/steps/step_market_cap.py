@@ -15,26 +15,33 @@ def build_market_cap(con):
 
     log("Building market_cap from CSV files...")
 
-    con.execute(f"""
+    # Materialize the ticker whitelist once; the SEMI JOIN below builds one hash table from it
+    con.execute("CREATE TEMP TABLE _valid_tickers AS SELECT ticker FROM read_parquet(?)",
+                [str(OUTPUT_DIR / "tickers.parquet")])
+    written = con.execute(f"""
         COPY (
-            SELECT
-                replace(string_split(filename, '/')[-1], '.csv', '') AS ticker,
-                CAST(date AS DATE) AS day,
-                CAST(market_cap AS BIGINT) AS cap
-            FROM read_csv(
-                '{csv_pattern}',
-                header=true,
-                columns={{'date': 'DATE', 'market_cap': 'BIGINT'}},
-                filename=true
-            )
-            WHERE ticker != ''
-              AND ticker IN (SELECT ticker FROM read_parquet('{OUTPUT_DIR / "tickers.parquet"}'))
-              AND cap > 0
-              AND cap < 20000000000000
-            ORDER BY ticker, day
+            SELECT m.ticker, m.day, m.cap
+            FROM (
+                SELECT
+                    replace(string_split(filename, '/')[-1], '.csv', '') AS ticker,
+                    CAST(date AS DATE) AS day,
+                    CAST(market_cap AS BIGINT) AS cap
+                FROM read_csv(
+                    ?,
+                    header=true,
+                    columns={{'date': 'DATE', 'market_cap': 'BIGINT'}},
+                    filename=true
+                )
+            ) m
+            SEMI JOIN _valid_tickers v USING (ticker)
+            WHERE m.ticker != ''
+              AND m.cap > 0
+              AND m.cap < 20000000000000
+            ORDER BY m.ticker, m.day
         ) TO '{tmp}' ({PARQUET_SETTINGS})
-    """)
+    """, [csv_pattern]).fetchone()[0]
+    con.execute("DROP TABLE _valid_tickers")
     tmp.rename(dest)
 
-    count = verify_parquet(str(dest))
+    count = verify_parquet(str(dest), rows_written=written)
     log(f"  Wrote {count:,} rows to market_cap.parquet")
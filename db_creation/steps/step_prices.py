@@ -1,243 +1,295 @@
 """Step 2: Extract ZIP archives and build Hive-partitioned hourly price data."""
 
+import multiprocessing
+import os
 import shutil
-import tempfile
+import threading
 import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 import duckdb
 
 from build_common import (
-    DUCKDB_MEMORY_LIMIT, DUCKDB_THREADS, ETFS_ZIP_DIR, OUTPUT_DIR,
+    ETFS_ZIP_DIR, OUTPUT_DIR,
     PARQUET_SETTINGS, REGULAR_HOURS_END, REGULAR_HOURS_START,
     STOCKS_ZIP_DIR, TICKER_SUFFIX,
-    log, log_progress, step, verify_parquet,
+    create_ticker_enum, log, log_progress, step, swap_in_dir, verify_parquet,
 )
 
+PASS1_WORKER_THREADS = 2  # DuckDB threads per Pass 1 worker (workers = step threads / 2)
+STREAM_BUFFER_SIZE = 1024 * 1024  # Pipe write buffer for streamed ZIP members
 
-@step("prices_v4", target="prices", depends_on=("tickers",))
-def build_prices(con):
+_worker_con = None  # Pass 1 worker process's staging connection (set by _init_worker)
+
+
+def _ticker_members(zf):
+    """Return [(ticker, ZipInfo)] for every per-ticker price file in an open ZIP."""
+    members = []
+    for info in zf.infolist():
+        basename = info.filename.rsplit("/", 1)[-1]
+        if basename.endswith(TICKER_SUFFIX) and basename != TICKER_SUFFIX:
+            members.append((basename[:-len(TICKER_SUFFIX)], info))
+    return members
+
+
+def _stream_members(zf, members, write_fd, errors):
     """
-    Three-pass approach:
-    Pass 1: Extract each ZIP, read CSVs, write temp parquet partitioned by year
-    Pass 2: For each year, merge fragments, deduplicate, sort, write final
-    Pass 3: Compute global trading_day_num, write trading_calendar.parquet,
-            enrich each year partition with trading_day_num
+    Writer thread for Pass 1: decompress each member straight from the ZIP and
+    write its lines to the pipe, prefixed with "{ticker}," so DuckDB reads the
+    whole archive as one headerless CSV. Exceptions are appended to `errors`.
     """
-    prices_dir = OUTPUT_DIR / "prices"
-    building_dir = OUTPUT_DIR / "prices_building"
-    temp_fragments_dir = OUTPUT_DIR / "_prices_temp_fragments"
+    try:
+        with os.fdopen(write_fd, "wb", buffering=STREAM_BUFFER_SIZE) as out:
+            for ticker, info in members:
+                with zf.open(info) as fh:
+                    data = fh.read()
+                data = data.rstrip(b"\r\n")
+                if not data:
+                    continue
+                prefix = ticker.encode() + b","
+                out.write(prefix + data.replace(b"\n", b"\n" + prefix) + b"\n")
+    except BrokenPipeError:
+        # Reader closed early (query error); the error is reported by the reader
+        pass
+    except Exception as e:
+        errors.append(e)
 
-    # Clean any prior state
-    for d in [building_dir, temp_fragments_dir]:
-        if d.exists():
-            shutil.rmtree(d)
 
-    temp_fragments_dir.mkdir(parents=True)
-    building_dir.mkdir(parents=True)
+def _init_worker(staging_dir, memory_limit, threads):
+    """
+    Pass 1 pool initializer: open this worker process's staging DuckDB database
+    (staging_dir/worker_{pid}.duckdb, table prices_raw) once, so every ZIP the
+    worker handles reuses the same connection and settings.
 
-    # Collect all ZIPs
-    stock_zips = sorted(STOCKS_ZIP_DIR.glob("*.zip"))
-    etf_zips = sorted(ETFS_ZIP_DIR.glob("*.zip"))
-    all_zips = [(z, "stock") for z in stock_zips] + [(z, "etf") for z in etf_zips]
-    total_zips = len(all_zips)
+    Rows are inserted clustered by `year`, so each staged row group holds one
+    year (or straddles one boundary) and Pass 2's per-year COPY skips the rest
+    of the table via row-group min/max on `year`.
+    """
+    global _worker_con
+    _worker_con = duckdb.connect(str(staging_dir / f"worker_{os.getpid()}.duckdb"))
+    _worker_con.execute(f"SET memory_limit = '{memory_limit}'")
+    _worker_con.execute(f"SET threads = {threads}")
+    # Ticker is the first column, written by the streaming thread
+    _worker_con.execute("""
+        CREATE TABLE IF NOT EXISTS prices_raw (
+            ticker VARCHAR, ts TIMESTAMP, open FLOAT, high FLOAT, low FLOAT,
+            close FLOAT, volume UINTEGER, _asset_type VARCHAR, year SMALLINT
+        )
+    """)
 
-    log(f"Pass 1: Processing {total_zips} ZIP files into temp fragments...")
-
-    # Pass 1: Extract each ZIP, read all CSVs, partition by year into temp fragments
-    for zip_idx, (zip_path, asset_type) in enumerate(all_zips):
-        log_progress(zip_idx + 1, total_zips, f"Processing {zip_path.name}")
-
-        with tempfile.TemporaryDirectory() as tmpdir:
-            # Extract ZIP
-            with zipfile.ZipFile(zip_path) as zf:
-                zf.extractall(tmpdir)
-
-            # Find all txt files
-            txt_files = list(Path(tmpdir).rglob("*.txt"))
-            if not txt_files:
-                log(f"  Warning: no .txt files in {zip_path.name}")
-                continue
-
-            # Use DuckDB to read all CSVs at once with filename-based ticker extraction
-            zcon = duckdb.connect(":memory:")
-            zcon.execute(f"SET memory_limit = '{DUCKDB_MEMORY_LIMIT}'")
-            zcon.execute(f"SET threads = {DUCKDB_THREADS}")
-
-            # Read all txt files - they have no header
-            glob_pattern = str(Path(tmpdir) / "**" / "*.txt")
-            suffix_sql = TICKER_SUFFIX.replace("'", "''")
-            try:
-                zcon.execute(f"""
-                    CREATE TABLE _raw AS
+
+def _ingest_zip(zip_path, asset_type):
+    """
+    Pass 1 worker: stream one ZIP's CSVs into this worker's staging database
+    inside a single transaction. Returns {"zip", "rows", "warning"}.
+    """
+    result = {"zip": zip_path.name, "rows": 0, "warning": None}
+
+    with zipfile.ZipFile(zip_path) as zf:
+        members = _ticker_members(zf)
+        if not members:
+            result["warning"] = f"Warning: no .txt files in {zip_path.name}"
+            return result
+
+        # Decompressed bytes go through a pipe instead of an extracted temp dir
+        read_fd, write_fd = os.pipe()
+        stream_errors = []
+        writer = threading.Thread(target=_stream_members, args=(zf, members, write_fd, stream_errors))
+        writer.start()
+        _worker_con.execute("BEGIN TRANSACTION")
+        try:
+            # Timestamps are read as text ("YYYY-MM-DD HH:MM:SS") so the regular-hours
+            # filter runs on the HH substring and only surviving rows pay for the cast.
+            # Volume is read wide and narrowed with TRY_CAST: an out-of-range volume
+            # becomes NULL instead of ignore_errors dropping the whole bar.
+            row_count = _worker_con.execute(f"""
+                INSERT INTO prices_raw
+                SELECT ticker, ts, open, high, low, close, volume, _asset_type,
+                       EXTRACT(YEAR FROM ts)::SMALLINT AS year
+                FROM (
                     SELECT
-                        replace(string_split(filename, '/')[-1], '{suffix_sql}', '') AS ticker,
-                        column0 AS ts,
+                        ticker,
+                        TRY_CAST(column0 AS TIMESTAMP) AS ts,
                         column1 AS open,
                         column2 AS high,
                         column3 AS low,
                         column4 AS close,
-                        column5 AS volume,
+                        TRY_CAST(column5 AS UINTEGER) AS volume,
                         '{asset_type}' AS _asset_type
                     FROM read_csv(
-                        '{glob_pattern}',
+                        '/dev/fd/{read_fd}',
                         header=false,
                         columns={{
-                            'column0': 'TIMESTAMP',
+                            'ticker': 'VARCHAR',
+                            'column0': 'VARCHAR',
                             'column1': 'FLOAT',
                             'column2': 'FLOAT',
                             'column3': 'FLOAT',
                             'column4': 'FLOAT',
-                            'column5': 'INTEGER'
+                            'column5': 'BIGINT'
                         }},
-                        filename=true,
                         ignore_errors=true
                     )
-                    WHERE replace(string_split(filename, '/')[-1], '{suffix_sql}', '')
-                        != string_split(filename, '/')[-1]
-                      AND EXTRACT(HOUR FROM column0) BETWEEN {REGULAR_HOURS_START} AND {REGULAR_HOURS_END}
-                """)
-
-                row_count = zcon.execute("SELECT COUNT(*) FROM _raw").fetchone()[0]
-                if row_count == 0:
-                    log(f"  Warning: no valid rows in {zip_path.name}")
-                    continue
-
-                # Get distinct years
-                years = [r[0] for r in zcon.execute(
-                    "SELECT DISTINCT EXTRACT(YEAR FROM ts)::INTEGER AS yr FROM _raw ORDER BY yr"
-                ).fetchall()]
-
-                # Write per-year fragments
-                frag_id = f"{asset_type}_{zip_path.stem}"
-                for year in years:
-                    frag_dir = temp_fragments_dir / f"year={year}"
-                    frag_dir.mkdir(exist_ok=True)
-                    frag_path = frag_dir / f"{frag_id}.parquet"
-                    zcon.execute(f"""
-                        COPY (
-                            SELECT ticker, ts, open, high, low, close, volume, _asset_type
-                            FROM _raw
-                            WHERE EXTRACT(YEAR FROM ts) = {year}
-                            ORDER BY ticker, ts
-                        ) TO '{frag_path}' ({PARQUET_SETTINGS})
-                    """)
-
-                zcon.execute("DROP TABLE _raw")
-            except Exception as e:
-                log(f"  Error processing {zip_path.name}: {e}")
-            finally:
-                zcon.close()
-
-    # Pass 2: For each year, merge fragments, deduplicate, sort, write final
-    log("Pass 2: Merging fragments per year...")
-    year_dirs = sorted(temp_fragments_dir.glob("year=*"))
-    total_years = len(year_dirs)
-
-    for yr_idx, year_dir in enumerate(year_dirs):
-        year = year_dir.name.split("=")[1]
-        log_progress(yr_idx + 1, total_years, f"Merging year={year}")
-
-        out_dir = building_dir / f"year={year}"
-        out_dir.mkdir(parents=True, exist_ok=True)
-        out_path = out_dir / "data.parquet"
-
-        mcon = duckdb.connect(":memory:")
-        mcon.execute(f"SET memory_limit = '{DUCKDB_MEMORY_LIMIT}'")
-        mcon.execute(f"SET threads = {DUCKDB_THREADS}")
-
-        frag_pattern = str(year_dir / "*.parquet")
-
-        # Read all fragments for this year, deduplicate: ETF wins over stock
-        # Use ROW_NUMBER to pick ETF over stock for overlapping (ticker, ts) pairs
-        mcon.execute(f"""
-            COPY (
-                SELECT ticker, ts, open, high, low, close, volume
-                FROM (
-                    SELECT *,
-                        ROW_NUMBER() OVER (
-                            PARTITION BY ticker, ts
-                            ORDER BY CASE WHEN _asset_type = 'etf' THEN 0 ELSE 1 END
-                        ) AS _rn
-                    FROM read_parquet('{frag_pattern}')
+                    WHERE substr(column0, 12, 2) BETWEEN '{REGULAR_HOURS_START:02d}' AND '{REGULAR_HOURS_END:02d}'
                 )
-                WHERE _rn = 1
-                ORDER BY ticker, ts
-            ) TO '{out_path}' ({PARQUET_SETTINGS})
-        """)
-        mcon.close()
-
-        count = verify_parquet(str(out_path))
-        log(f"  year={year}: {count:,} rows")
-
-    # Swap in the final directory
-    if prices_dir.exists():
-        stale = Path(str(prices_dir) + "_old")
-        prices_dir.rename(stale)
-        building_dir.rename(prices_dir)
-        shutil.rmtree(stale)
-    else:
-        building_dir.rename(prices_dir)
-
-    # Clean up temp fragments
-    shutil.rmtree(temp_fragments_dir)
+                WHERE ts IS NOT NULL
+                ORDER BY year
+            """).fetchone()[0]
+            writer.join()
+            if stream_errors:
+                raise stream_errors[0]
+            _worker_con.execute("COMMIT")
+
+            if row_count == 0:
+                result["warning"] = f"Warning: no valid rows in {zip_path.name}"
+            result["rows"] = row_count
+        except Exception as e:
+            # Roll back so a half-ingested ZIP leaves nothing behind in the shared staging DB
+            _worker_con.execute("ROLLBACK")
+            result["warning"] = f"Error processing {zip_path.name}: {e}"
+        finally:
+            os.close(read_fd)
+            writer.join()
+
+    return result
+
+
+@step("prices_v6", target="prices", depends_on=("tickers",))
+def build_prices(con):
+    """
+    Two-pass approach, each price row written to parquet exactly once:
+    Pass 1: Stream each ZIP (in parallel worker processes) into per-worker
+            staging DuckDB databases
+    Pass 2: Compute global trading_day_num and write trading_calendar.parquet,
+            then per year deduplicate, join trading_day_num, sort, write final
+    """
+    prices_dir = OUTPUT_DIR / "prices"
+    building_dir = OUTPUT_DIR / "prices_building"
+    staging_dir = OUTPUT_DIR / "_prices_staging"
 
-    # Pass 3: Compute global trading_day_num and write trading_calendar.parquet
-    log("Pass 3: Computing global trading_day_num...")
+    # Clean any prior state
+    for d in [building_dir, staging_dir]:
+        if d.exists():
+            shutil.rmtree(d)
 
-    prices_pattern = str(prices_dir / "**" / "*.parquet")
-    calendar_dest = OUTPUT_DIR / "trading_calendar.parquet"
-    calendar_tmp = Path(str(calendar_dest) + ".tmp")
+    staging_dir.mkdir(parents=True)
+    building_dir.mkdir(parents=True)
 
-    ccon = duckdb.connect(":memory:")
-    ccon.execute(f"SET memory_limit = '{DUCKDB_MEMORY_LIMIT}'")
-    ccon.execute(f"SET threads = {DUCKDB_THREADS}")
+    # Collect all ZIPs
+    stock_zips = sorted(STOCKS_ZIP_DIR.glob("*.zip"))
+    etf_zips = sorted(ETFS_ZIP_DIR.glob("*.zip"))
+    all_zips = [(z, "stock") for z in stock_zips] + [(z, "etf") for z in etf_zips]
+    total_zips = len(all_zips)
 
-    ccon.execute(f"""
-        CREATE TABLE _calendar AS
+    # Workers split this step's own budget (already divided by the scheduler), not the machine's
+    step_threads, step_memory = con.execute(
+        "SELECT current_setting('threads'), parse_formatted_bytes(current_setting('memory_limit'))"
+    ).fetchone()
+    worker_threads = min(PASS1_WORKER_THREADS, step_threads)
+    workers = max(1, min(total_zips, step_threads // worker_threads))
+    log(f"Pass 1: Streaming {total_zips} ZIP files into staging databases ({workers} workers)...")
+
+    # Pass 1: Each ZIP is independent — stream CSVs into the worker's staging DB in parallel
+    memory_limit = f"{step_memory // workers // (1024 * 1024)}MB"
+    # forkserver: this process already runs DuckDB threads, which fork would copy mid-lock
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("forkserver"),
+        initializer=_init_worker, initargs=(staging_dir, memory_limit, worker_threads),
+    ) as executor:
+        futures = {
+            executor.submit(_ingest_zip, zip_path, asset_type): zip_path
+            for zip_path, asset_type in all_zips
+        }
+        for done_idx, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            log_progress(done_idx, total_zips, f"Processed {result['zip']} ({result['rows']:,} rows)")
+            if result["warning"]:
+                log(f"  {result['warning']}")
+
+    staging_dbs = sorted(staging_dir.glob("*.duckdb"))
+    if not staging_dbs:
+        raise RuntimeError("No price rows ingested from any ZIP")
+
+    # Pass 2: Read all staging DBs through one view
+    log(f"Pass 2: Merging {len(staging_dbs)} staging databases...")
+    for i, db_path in enumerate(staging_dbs):
+        con.execute(f"ATTACH '{db_path}' AS _stage{i} (READ_ONLY)")
+    con.execute("CREATE TEMP VIEW _raw AS " + " UNION ALL ".join(
+        f"SELECT * FROM _stage{i}.prices_raw" for i in range(len(staging_dbs))
+    ))
+
+    # Dedup never drops a date, so the calendar can come straight from the raw rows
+    con.execute("""
+        CREATE TEMP TABLE _calendar AS
         SELECT
             day,
             ROW_NUMBER() OVER (ORDER BY day)::SMALLINT AS trading_day_num
         FROM (
             SELECT DISTINCT CAST(ts AS DATE) AS day
-            FROM read_parquet('{prices_pattern}', hive_partitioning=true)
+            FROM _raw
         )
     """)
 
-    cal_count = ccon.execute("SELECT COUNT(*) FROM _calendar").fetchone()[0]
-    cal_range = ccon.execute("SELECT MIN(day), MAX(day) FROM _calendar").fetchone()
+    cal_count = con.execute("SELECT COUNT(*) FROM _calendar").fetchone()[0]
+    cal_range = con.execute("SELECT MIN(day), MAX(day) FROM _calendar").fetchone()
     log(f"  {cal_count:,} trading days ({cal_range[0]} to {cal_range[1]})")
 
-    ccon.execute(f"""
-        COPY (SELECT trading_day_num, day FROM _calendar ORDER BY trading_day_num)
-        TO '{calendar_tmp}' ({PARQUET_SETTINGS})
-    """)
-    calendar_tmp.rename(calendar_dest)
-    verify_parquet(str(calendar_dest))
-    log(f"  Wrote trading_calendar.parquet")
+    years = [r[0] for r in con.execute(
+        "SELECT DISTINCT EXTRACT(YEAR FROM day)::INTEGER AS yr FROM _calendar ORDER BY yr"
+    ).fetchall()]
+    create_ticker_enum(con, "_raw")
+    total_years = len(years)
+
+    for yr_idx, year in enumerate(years):
+        log_progress(yr_idx + 1, total_years, f"Writing year={year}")
 
-    # Enrich each year partition with trading_day_num
-    log("  Enriching price partitions with trading_day_num...")
-    year_dirs = sorted(prices_dir.glob("year=*"))
-    for year_dir in year_dirs:
-        year = year_dir.name.split("=")[1]
-        data_path = year_dir / "data.parquet"
-        tmp_path = year_dir / "data.parquet.tmp"
+        out_dir = building_dir / f"year={year}"
+        out_dir.mkdir(parents=True, exist_ok=True)
+        out_path = out_dir / "data.parquet"
 
-        ccon.execute(f"""
+        # Deduplicate: ETF wins over stock for overlapping (ticker, ts) pairs. Sorted by
+        # (ticker, ts) so each row group spans few tickers and min/max stats prune on ticker.
+        # No temp file: the whole building dir is swapped in atomically afterwards.
+        written = con.execute(f"""
             COPY (
                 SELECT p.ticker, p.ts, p.open, p.high, p.low, p.close, p.volume,
                        c.trading_day_num
-                FROM read_parquet('{data_path}') p
+                FROM (
+                    SELECT * REPLACE (ticker::ticker_enum AS ticker),
+                        ROW_NUMBER() OVER (
+                            PARTITION BY ticker, ts
+                            ORDER BY CASE WHEN _asset_type = 'etf' THEN 0 ELSE 1 END
+                        ) AS _rn
+                    FROM _raw
+                    WHERE year = {year}
+                ) p
                 JOIN _calendar c ON CAST(p.ts AS DATE) = c.day
+                WHERE p._rn = 1
                 ORDER BY p.ticker, p.ts
-            ) TO '{tmp_path}' ({PARQUET_SETTINGS})
-        """)
-        tmp_path.rename(data_path)
-        log(f"    year={year}: enriched")
+            ) TO '{out_path}' ({PARQUET_SETTINGS}, USE_TMP_FILE false)
+        """).fetchone()[0]
+
+        count = verify_parquet(str(out_path), rows_written=written)
+        log(f"  year={year}: {count:,} rows")
 
-    ccon.execute("DROP TABLE _calendar")
-    ccon.close()
+    con.execute("DROP VIEW _raw")
+    con.execute("DROP TYPE ticker_enum")
+    for i in range(len(staging_dbs)):
+        con.execute(f"DETACH _stage{i}")
+    shutil.rmtree(staging_dir)
 
-    total = verify_parquet(str(prices_dir / "**" / "*.parquet"))
-    log(f"  Wrote {total:,} total price rows")
+    # Swap in the final directory (symlink; old snapshot deleted in the background)
+    swap_in_dir(building_dir, prices_dir)
+
+    # Calendar is written after the swap so it never describes prices that aren't in place
+    calendar_dest = OUTPUT_DIR / "trading_calendar.parquet"
+    calendar_tmp = Path(str(calendar_dest) + ".tmp")
+    written = con.execute(f"""
+        COPY (SELECT trading_day_num, day FROM _calendar ORDER BY trading_day_num)
+        TO '{calendar_tmp}' ({PARQUET_SETTINGS})
+    """).fetchone()[0]
+    con.execute("DROP TABLE _calendar")
+    calendar_tmp.rename(calendar_dest)
+    verify_parquet(str(calendar_dest), rows_written=written)
+    log(f"  Wrote trading_calendar.parquet")
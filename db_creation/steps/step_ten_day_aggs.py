@@ -2,7 +2,9 @@
 
 from pathlib import Path
 
-from build_common import OUTPUT_DIR, PARQUET_SETTINGS, log, step, verify_parquet
+from build_common import (
+    OUTPUT_DIR, PARQUET_SETTINGS_AGGS, create_ticker_enum, log, step, verify_parquet,
+)
 
 
 @step("ten_day_aggs_v1", target="ten_day_aggs", depends_on=("daily_aggs",), disabled=True)
@@ -14,10 +16,11 @@ def build_ten_day_aggs(con):
 
     log("Building 10-day aggregates...")
 
-    con.execute(f"""
+    create_ticker_enum(con, f"read_parquet('{daily_path}')")
+    written = con.execute(f"""
         COPY (
             WITH numbered AS (
-                SELECT *,
+                SELECT * REPLACE (ticker::ticker_enum AS ticker),
                     (ROW_NUMBER() OVER (PARTITION BY ticker ORDER BY day) - 1) // 10 AS block_id
                 FROM read_parquet('{daily_path}', hive_partitioning=true)
             )
@@ -27,10 +30,11 @@ def build_ten_day_aggs(con):
                 MAX(day) AS block_end,
 
                 -- Block OHLCV
-                FIRST(open ORDER BY day) AS open,
+                -- Wrapped in a struct so a NULL open/close is returned, not skipped (as FIRST/LAST did)
+                ARG_MIN({{'v': open}}, day).v AS open,
                 MAX(high) AS high,
                 MIN(low) AS low,
-                LAST(close ORDER BY day) AS close,
+                ARG_MAX({{'v': close}}, day).v AS close,
                 SUM(volume)::BIGINT AS volume,
 
                 -- Component sums (sum of daily component sums)
@@ -45,9 +49,9 @@ def build_ten_day_aggs(con):
             FROM numbered
             GROUP BY ticker, block_id
             ORDER BY ticker, block_start
-        ) TO '{tmp}' ({PARQUET_SETTINGS})
-    """)
+        ) TO '{tmp}' ({PARQUET_SETTINGS_AGGS})
+    """).fetchone()[0]
     tmp.rename(dest)
 
-    count = verify_parquet(str(dest))
+    count = verify_parquet(str(dest), rows_written=written)
     log(f"  Wrote {count:,} rows to ten_day_aggs.parquet")
@@ -4,49 +4,52 @@ from pathlib import Path
 
 from build_common import (
     ETFS_ZIP_DIR, OUTPUT_DIR, PARQUET_SETTINGS, STOCKS_ZIP_DIR,
-    discover_tickers_from_zips, log, step, verify_parquet,
+    iter_zip_tickers, log, step, verify_parquet,
 )
 
 
 @step("tickers_v1", target="tickers")
 def build_tickers(con):
     """Scan ZIP filenames to discover all tickers. ETF wins on overlap."""
-    log("Discovering tickers from stock ZIPs...")
-    stock_tickers = discover_tickers_from_zips(STOCKS_ZIP_DIR)
-    log(f"  Found {len(stock_tickers)} stock tickers")
-
-    log("Discovering tickers from ETF ZIPs...")
-    etf_tickers = discover_tickers_from_zips(ETFS_ZIP_DIR)
-    log(f"  Found {len(etf_tickers)} ETF tickers")
-
-    # Build rows: ETF wins on overlap
-    rows = []
-    all_tickers = sorted(set(stock_tickers) | set(etf_tickers))
-    overlap_count = 0
-    for ticker in all_tickers:
-        if ticker in etf_tickers:
-            asset_type = "etf"
-            if ticker in stock_tickers:
-                overlap_count += 1
-        else:
-            asset_type = "stock"
-        rows.append((ticker, asset_type))
-
-    log(f"  Total: {len(rows)} tickers ({overlap_count} overlap, classified as ETF)")
+    # Stage every (ticker, is_etf) pair; dedup + classification happen in one GROUP BY
+    con.execute("CREATE TEMP TABLE _stage (ticker VARCHAR, is_etf BOOLEAN)")
+    for label, zip_dir, is_etf in (("stock", STOCKS_ZIP_DIR, False), ("ETF", ETFS_ZIP_DIR, True)):
+        log(f"Discovering tickers from {label} ZIPs...")
+        for _, tickers in iter_zip_tickers(zip_dir):
+            # One bulk insert per ZIP: the whole list binds as a single parameter
+            con.execute("INSERT INTO _stage SELECT unnest(?::VARCHAR[]), ?", [tickers, is_etf])
+        found = con.execute(
+            "SELECT COUNT(DISTINCT ticker) FROM _stage WHERE is_etf = ?", [is_etf]
+        ).fetchone()[0]
+        log(f"  Found {found} {label} tickers")
+
+    con.execute("""
+        CREATE TEMP TABLE _tickers AS
+        SELECT
+            ticker,
+            CASE WHEN bool_or(is_etf) THEN 'etf' ELSE 'stock' END AS asset_type,
+            bool_or(is_etf) AND NOT bool_and(is_etf) AS _overlap
+        FROM _stage
+        GROUP BY ticker
+    """)
+    con.execute("DROP TABLE _stage")
+    total, overlap_count = con.execute(
+        "SELECT COUNT(*), COUNT(*) FILTER (WHERE _overlap) FROM _tickers"
+    ).fetchone()
+
+    log(f"  Total: {total} tickers ({overlap_count} overlap, classified as ETF)")
 
     # Write via DuckDB
     dest = OUTPUT_DIR / "tickers.parquet"
     tmp = Path(str(dest) + ".tmp")
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-    con.execute("CREATE TABLE _tickers (ticker VARCHAR, asset_type VARCHAR)")
-    con.executemany("INSERT INTO _tickers VALUES (?, ?)", rows)
-    con.execute(f"""
-        COPY (SELECT * FROM _tickers ORDER BY ticker)
+    written = con.execute(f"""
+        COPY (SELECT ticker, asset_type FROM _tickers ORDER BY ticker)
         TO '{tmp}' ({PARQUET_SETTINGS})
-    """)
+    """).fetchone()[0]
     con.execute("DROP TABLE _tickers")
     tmp.rename(dest)
 
-    count = verify_parquet(str(dest))
+    count = verify_parquet(str(dest), rows_written=written)
     log(f"  Wrote {count} rows to tickers.parquet")
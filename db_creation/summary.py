@@ -12,40 +12,114 @@ Usage:
 """
 
 import argparse
+import io
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
 import duckdb
 
 DB_DIR = Path(__file__).resolve().parent.parent / "db"
 
-con = duckdb.connect(":memory:")
 
+def connect(share=1):
+    """Open a configured in-memory DuckDB connection (one per table summary).
 
-def q(sql):
-    return con.execute(sql).fetchall()
+    `share` is the number of summaries running concurrently; the cores are split
+    between them so the separate DuckDB instances don't oversubscribe.
+    """
+    con = duckdb.connect(":memory:")
+    con.execute(f"SET threads = {max(1, (os.cpu_count() or 1) // share)}")
+    # Every table is scanned several times; keep parsed footers between queries
+    con.execute("SET parquet_metadata_cache = true")
+    # Every query whose output order matters says ORDER BY
+    con.execute("SET preserve_insertion_order = false")
+    return con
 
 
-def q1(sql):
-    rows = q(sql)
+def q(cur, sql, params=None):
+    return cur.execute(sql, params).fetchall()
+
+
+def q1(cur, sql, params=None):
+    rows = q(cur, sql, params)
     return rows[0][0] if rows else None
 
 
+fmt_int = "{:,}".format
+fmt_float = "{:,.2f}".format
+
+# Per-year table rows, bound once: (year, rows, tickers, size[, rows/ticker])
+YEAR_ROW = "  {:>6} {:>14} {:>9} {:>8}\n".format
+YEAR_ROW_RPT = "  {:>6} {:>14} {:>9} {:>8} {:>12}\n".format
+
+
 def fmt(n):
+    """Format a value whose type isn't known up front (may be None, int or float).
+
+    Call sites that know the type use fmt_int / fmt_float directly.
+    """
     if n is None:
         return "N/A"
-    if isinstance(n, float):
-        return f"{n:,.2f}"
-    return f"{n:,}"
+    return fmt_float(n) if isinstance(n, float) else fmt_int(n)
+
+
+@lru_cache(maxsize=None)
+def _tree_sizes(root):
+    """
+    Walk `root` (a resolved path string) once and return {path: bytes} for it and
+    every file and directory below it; directory totals are accumulated upward
+    from their files. Symlinks inside the tree are not followed, so a symlinked
+    table dir is counted once, under the snapshot it points to.
+    """
+    sizes = {}
+
+    def walk(path):
+        total = 0
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_file(follow_symlinks=False):
+                    size = entry.stat(follow_symlinks=False).st_size
+                    sizes[entry.path] = size
+                elif entry.is_dir(follow_symlinks=False):
+                    size = walk(entry.path)
+                else:
+                    continue
+                total += size
+        sizes[path] = total
+        return total
+
+    walk(root)
+    return sizes
+
+
+def path_bytes(path):
+    """Bytes in a file or directory (None if missing), looked up in one cached walk."""
+    real = os.path.realpath(path)
+    if not os.path.exists(real):
+        return None
+    root = os.path.realpath(DB_DIR)
+    if real != root and not real.startswith(root + os.sep):
+        root = real if os.path.isdir(real) else os.path.dirname(real)
+    return _tree_sizes(root)[real]
+
+
+def dir_size_by_child(root):
+    """Return ({immediate child name: bytes}, total bytes) for a directory."""
+    real = os.path.realpath(root)
+    with os.scandir(real) as it:
+        sizes = {entry.name: path_bytes(entry.path) for entry in it}
+    return sizes, path_bytes(real)
 
 
 def file_size(path):
-    if path.is_dir():
-        total = sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
-    elif path.exists():
-        total = path.stat().st_size
-    else:
+    return human_size(path_bytes(path))
+
+
+def human_size(total):
+    if total is None:
         return "N/A"
     for unit in ("B", "KB", "MB", "GB"):
         if total < 1024:
@@ -54,438 +128,526 @@ def file_size(path):
     return f"{total:.1f}TB"
 
 
-def section(title):
-    print(f"\n{'=' * 60}")
-    print(f"  {title}")
-    print(f"{'=' * 60}")
+def section(out, title):
+    out.write(f"\n{'=' * 60}\n  {title}\n{'=' * 60}\n")
+
+
+def print_schema(cur, out, path, hive=False):
+    """Print the schema of a parquet file from its footer via parquet_schema().
+
+    For a Hive-partitioned table, `path` is the table directory: the schema is
+    uniform, so only one file is read, and the partition keys in its path are
+    appended (as BIGINT, the type hive_partitioning infers for year=YYYY).
+    """
+    extra = []
+    if hive:
+        first = next(path.glob("*=*/*.parquet"), None)
+        if first is None:
+            print("  Schema: N/A (no parquet files)", file=out)
+            return
+        extra = [f"{part.split('=', 1)[0]} (BIGINT)" for part in first.relative_to(path).parent.parts]
+        path = first
+    cols = q(cur, """
+        SELECT name, duckdb_type FROM parquet_schema(?)
+        WHERE duckdb_type IS NOT NULL
+        ORDER BY column_id
+    """, [str(path)])
+    parts = [f"{name} ({dtype})" for name, dtype in cols] + extra
+    print(f"  Schema: {', '.join(parts)}", file=out)
+
+
+def register_view(cur, name, path, hive=False):
+    """
+    CREATE TEMP VIEW `name` over a parquet file, or over every data file of a
+    Hive-partitioned table dir. The file list is expanded once here, so later
+    queries against the view don't re-glob the directory tree.
+    """
+    if hive:
+        files = ", ".join("'" + str(f).replace("'", "''") + "'" for f in sorted(path.glob("*=*/*.parquet")))
+        source = f"read_parquet([{files}], hive_partitioning=true)"
+    else:
+        source = "read_parquet('" + str(path).replace("'", "''") + "')"
+    cur.execute(f"CREATE OR REPLACE TEMP VIEW {name} AS SELECT * FROM {source}")
+
+
+def footer_rows(cur, path_glob):
+    """Row count of a parquet file/glob from the file footers alone (no column data read)."""
+    return q1(cur, "SELECT COALESCE(SUM(num_rows), 0) FROM parquet_file_metadata(?)", [str(path_glob)])
+
+
+def footer_range(cur, path_glob, column, sql_type="DATE"):
+    """
+    (min, max) of a column from the row-group statistics in the parquet footers,
+    so no column data is read. Falls back to a scan if any row group lacks stats.
+    """
+    lo, hi, missing = q(cur, f"""
+        SELECT MIN(stats_min_value::{sql_type}), MAX(stats_max_value::{sql_type}),
+               COUNT(*) FILTER (WHERE stats_min_value IS NULL OR stats_max_value IS NULL)
+        FROM parquet_metadata(?)
+        WHERE path_in_schema = ?
+    """, [str(path_glob), column])[0]
+    if missing:
+        return q(cur, f"SELECT MIN({column}), MAX({column}) FROM read_parquet(?)", [str(path_glob)])[0]
+    return lo, hi
+
+
+def rollup_by_year(cur, view, extra_aggs=""):
+    """
+    Grand totals and the per-year breakdown of a Hive-partitioned view in one
+    scan via GROUPING SETS ((), (year)). Each row is (year, rows, tickers, *extra);
+    returns (totals_row, per_year_rows), where the totals row has year = NULL.
+    Ticker counts are HyperLogLog estimates (approx_count_distinct).
+    """
+    rows = q(cur, f"""
+        SELECT year, COUNT(*), approx_count_distinct(ticker){extra_aggs}
+        FROM {view}
+        GROUP BY GROUPING SETS ((), (year))
+        ORDER BY year NULLS FIRST
+    """)
+    return rows[0], rows[1:]
 
 
-def print_schema(parquet_expr):
-    """Print the schema of a parquet source using DESCRIBE."""
-    cols = q(f"DESCRIBE SELECT * FROM {parquet_expr}")
-    parts = [f"{name} ({dtype})" for name, dtype, *_ in cols]
-    print(f"  Schema: {', '.join(parts)}")
+def print_year_table(out, per_year, sizes):
+    """Print the Year/Rows/Tickers/Size table from rollup_by_year rows in one write."""
+    out.write("\n" + YEAR_ROW("Year", "Rows", "Tickers", "Size") + f"  {'-'*41}\n")
+    out.write("".join(
+        YEAR_ROW(yr, fmt_int(rows), fmt_int(tkrs), human_size(sizes.get(f"year={yr}")))
+        for yr, rows, tkrs, *_ in per_year
+    ))
 
 
 # ---------------------------------------------------------------------------
 # Tickers
 # ---------------------------------------------------------------------------
 
-def summarize_tickers():
+def summarize_tickers(cur, out):
     p = DB_DIR / "tickers.parquet"
     if not p.exists():
-        section("TICKERS — not found"); return
-    section("TICKERS")
-    print_schema(f"read_parquet('{p}')")
-
-    total = q1(f"SELECT COUNT(*) FROM read_parquet('{p}')")
-    breakdown = q(f"""
-        SELECT asset_type, COUNT(*) FROM read_parquet('{p}')
+        section(out, "TICKERS — not found"); return
+    section(out, "TICKERS")
+    print_schema(cur, out, p)
+    register_view(cur, "tickers", p)
+
+    total = footer_rows(cur, p)
+    breakdown = q(cur, """
+        SELECT asset_type, COUNT(*) FROM tickers
         GROUP BY asset_type ORDER BY asset_type
     """)
-    parts = ", ".join(f"{fmt(c)} {t}" for t, c in breakdown)
-    print(f"  Rows: {fmt(total)}  ({parts})")
-    print(f"  File: {file_size(p)}")
+    parts = ", ".join(f"{fmt_int(c)} {t}" for t, c in breakdown)
+    print(f"  Rows: {fmt_int(total)}  ({parts})", file=out)
+    print(f"  File: {file_size(p)}", file=out)
 
-    sample = q(f"SELECT ticker, asset_type FROM read_parquet('{p}') USING SAMPLE 10")
-    print(f"  Sample: {', '.join(f'{t}({a})' for t, a in sample)}")
+    sample = q(cur, "SELECT ticker, asset_type FROM tickers LIMIT 10")
+    print(f"  Sample: {', '.join(f'{t}({a})' for t, a in sample)}", file=out)
 
 
 # ---------------------------------------------------------------------------
 # Prices
 # ---------------------------------------------------------------------------
 
-def summarize_prices():
+def summarize_prices(cur, out):
     d = DB_DIR / "prices"
     if not d.exists():
-        section("PRICES — not found"); return
-    section("PRICES")
+        section(out, "PRICES — not found"); return
+    section(out, "PRICES")
     pp = str(d / "**" / "*.parquet")
-    print_schema(f"read_parquet('{pp}', hive_partitioning=true)")
-
-    total = q1(f"SELECT COUNT(*) FROM read_parquet('{pp}', hive_partitioning=true)")
-    tickers = q1(f"SELECT COUNT(DISTINCT ticker) FROM read_parquet('{pp}', hive_partitioning=true)")
-    yr_range = q(f"""
-        SELECT MIN(year), MAX(year) FROM read_parquet('{pp}', hive_partitioning=true)
-    """)[0]
-    print(f"  Rows: {fmt(total)} | Tickers: {fmt(tickers)} | Years: {yr_range[0]}-{yr_range[1]}")
-    print(f"  Total size: {file_size(d)}")
-
-    print(f"\n  {'Year':>6} {'Rows':>14} {'Tickers':>9} {'Size':>8} {'Rows/Ticker':>12}")
-    print(f"  {'-'*53}")
-    per_year = q(f"""
-        SELECT year, COUNT(*) as rows, COUNT(DISTINCT ticker) as tickers
-        FROM read_parquet('{pp}', hive_partitioning=true)
-        GROUP BY year ORDER BY year
-    """)
-    for yr, rows, tkrs in per_year:
-        yr_dir = d / f"year={yr}"
-        sz = file_size(yr_dir)
-        rpt = rows // tkrs if tkrs else 0
-        print(f"  {yr:>6} {fmt(rows):>14} {fmt(tkrs):>9} {sz:>8} {fmt(rpt):>12}")
-
-    sample = q(f"""
+    print_schema(cur, out, d, hive=True)
+    register_view(cur, "prices", d, hive=True)
+
+    # Row counts come from the footers, per year=YYYY directory; only the ticker
+    # column is scanned. Rows per ticker is divided in SQL, per group.
+    rows = q(cur, r"""
+        SELECT t.year, f.rows, t.tickers, f.rows // t.tickers
+        FROM (
+            SELECT year, approx_count_distinct(ticker) AS tickers
+            FROM prices
+            GROUP BY GROUPING SETS ((), (year))
+        ) t
+        JOIN (
+            SELECT year, SUM(num_rows)::BIGINT AS rows
+            FROM (
+                SELECT regexp_extract(file_name, 'year=(\d+)/[^/]*$', 1)::BIGINT AS year, num_rows
+                FROM parquet_file_metadata(?)
+            )
+            GROUP BY GROUPING SETS ((), (year))
+        ) f ON t.year IS NOT DISTINCT FROM f.year
+        ORDER BY t.year NULLS FIRST
+    """, [pp])
+    (_, total, tickers, _), per_year = rows[0], rows[1:]
+    yr_range = (per_year[0][0], per_year[-1][0]) if per_year else (None, None)
+    print(f"  Rows: {fmt_int(total)} | Tickers: {fmt_int(tickers)} | Years: {yr_range[0]}-{yr_range[1]}", file=out)
+    sizes, total_bytes = dir_size_by_child(d)
+    print(f"  Total size: {human_size(total_bytes)}", file=out)
+
+    out.write("\n" + YEAR_ROW_RPT("Year", "Rows", "Tickers", "Size", "Rows/Ticker") + f"  {'-'*53}\n")
+    out.write("".join(
+        YEAR_ROW_RPT(yr, fmt_int(rows), fmt_int(tkrs), human_size(sizes.get(f"year={yr}")), fmt_int(rpt))
+        for yr, rows, tkrs, rpt in per_year
+    ))
+
+    sample = q(cur, """
         SELECT ticker, ts, open, high, low, close, volume, trading_day_num
-        FROM read_parquet('{pp}', hive_partitioning=true) USING SAMPLE 5
+        FROM prices LIMIT 5
     """)
-    print(f"\n  Sample rows:")
-    for t, ts, o, h, l, c, v, tdn in sample:
-        print(f"    {t:>6} | {ts} | O:{o:.2f} H:{h:.2f} L:{l:.2f} C:{c:.2f} | V:{fmt(v)} | tdn:{tdn}")
+    print(f"\n  Sample rows:", file=out)
+    out.write("".join(
+        f"    {t:>6} | {ts} | O:{o:.2f} H:{h:.2f} L:{l:.2f} C:{c:.2f} | V:{fmt(v)} | tdn:{tdn}\n"
+        for t, ts, o, h, l, c, v, tdn in sample
+    ))
 
 
 # ---------------------------------------------------------------------------
 # Daily Aggs
 # ---------------------------------------------------------------------------
 
-def summarize_daily_aggs():
+def summarize_daily_aggs(cur, out):
     d = DB_DIR / "daily_aggs"
     if not d.exists():
-        section("DAILY AGGS — not found"); return
-    section("DAILY AGGS")
-    pp = str(d / "**" / "*.parquet")
-    print_schema(f"read_parquet('{pp}', hive_partitioning=true)")
-
-    total = q1(f"SELECT COUNT(*) FROM read_parquet('{pp}', hive_partitioning=true)")
-    tickers = q1(f"SELECT COUNT(DISTINCT ticker) FROM read_parquet('{pp}', hive_partitioning=true)")
-    date_range = q(f"SELECT MIN(day), MAX(day) FROM read_parquet('{pp}', hive_partitioning=true)")[0]
-    print(f"  Rows: {fmt(total)} | Tickers: {fmt(tickers)} | Dates: {date_range[0]} to {date_range[1]}")
-    print(f"  Total size: {file_size(d)}")
-
-    cnt_stats = q(f"""
-        SELECT MIN(cnt), MEDIAN(cnt)::INT, MAX(cnt),
-               ROUND(AVG(cnt), 1)
-        FROM read_parquet('{pp}', hive_partitioning=true)
-    """)[0]
-    print(f"  Bars per day — min: {cnt_stats[0]}, median: {cnt_stats[1]}, max: {cnt_stats[2]}, avg: {cnt_stats[3]}")
-
-    days_per_ticker = q(f"""
-        SELECT MIN(days), MEDIAN(days)::INT, MAX(days)
-        FROM (SELECT COUNT(*) as days FROM read_parquet('{pp}', hive_partitioning=true) GROUP BY ticker)
-    """)[0]
-    print(f"  Days per ticker — min: {fmt(days_per_ticker[0])}, median: {fmt(days_per_ticker[1])}, max: {fmt(days_per_ticker[2])}")
-
-    print(f"\n  {'Year':>6} {'Rows':>14} {'Tickers':>9} {'Size':>8}")
-    print(f"  {'-'*41}")
-    per_year = q(f"""
-        SELECT year, COUNT(*) as rows, COUNT(DISTINCT ticker) as tickers
-        FROM read_parquet('{pp}', hive_partitioning=true)
-        GROUP BY year ORDER BY year
+        section(out, "DAILY AGGS — not found"); return
+    section(out, "DAILY AGGS")
+    print_schema(cur, out, d, hive=True)
+    register_view(cur, "daily_aggs", d, hive=True)
+
+    # One scan: the columns needed are materialized once, then feed both the
+    # GROUPING SETS rollup (with cnt stats) and the days-per-ticker distribution
+    rows = q(cur, """
+        WITH base AS MATERIALIZED (
+            SELECT ticker, year, day, cnt FROM daily_aggs
+        ),
+        per_ticker AS (
+            SELECT MIN(days), MEDIAN(days)::INT, MAX(days)
+            FROM (SELECT COUNT(*) AS days FROM base GROUP BY ticker)
+        )
+        SELECT r.*, per_ticker.*
+        FROM (
+            SELECT year, COUNT(*), approx_count_distinct(ticker), MIN(day), MAX(day),
+                   MIN(cnt), MEDIAN(cnt)::INT, MAX(cnt), ROUND(AVG(cnt), 1)
+            FROM base
+            GROUP BY GROUPING SETS ((), (year))
+        ) r, per_ticker
+        ORDER BY r.year NULLS FIRST
     """)
-    for yr, rows, tkrs in per_year:
-        yr_dir = d / f"year={yr}"
-        sz = file_size(yr_dir)
-        print(f"  {yr:>6} {fmt(rows):>14} {fmt(tkrs):>9} {sz:>8}")
+    (_, total, tickers, min_day, max_day, *cnt_stats), per_year = rows[0][:9], rows[1:]
+    days_per_ticker = rows[0][9:]
+    print(f"  Rows: {fmt_int(total)} | Tickers: {fmt_int(tickers)} | Dates: {min_day} to {max_day}", file=out)
+    sizes, total_bytes = dir_size_by_child(d)
+    print(f"  Total size: {human_size(total_bytes)}", file=out)
+    print(f"  Bars per day — min: {cnt_stats[0]}, median: {cnt_stats[1]}, max: {cnt_stats[2]}, avg: {cnt_stats[3]}", file=out)
+    print(f"  Days per ticker — min: {fmt(days_per_ticker[0])}, median: {fmt(days_per_ticker[1])}, max: {fmt(days_per_ticker[2])}", file=out)
+
+    print_year_table(out, per_year, sizes)
 
-    sample = q(f"""
+    sample = q(cur, """
         SELECT ticker, day, open, high, low, close, volume, cnt
-        FROM read_parquet('{pp}', hive_partitioning=true) USING SAMPLE 5
+        FROM daily_aggs LIMIT 5
     """)
-    print(f"\n  Sample rows:")
-    for t, d_, o, h, l, c, v, cnt in sample:
-        print(f"    {t:>6} | {d_} | O:{o:.2f} H:{h:.2f} L:{l:.2f} C:{c:.2f} | V:{fmt(v)} | {cnt} bars")
+    print(f"\n  Sample rows:", file=out)
+    out.write("".join(
+        f"    {t:>6} | {d_} | O:{o:.2f} H:{h:.2f} L:{l:.2f} C:{c:.2f} | V:{fmt(v)} | {cnt} bars\n"
+        for t, d_, o, h, l, c, v, cnt in sample
+    ))
 
 
 # ---------------------------------------------------------------------------
 # N-day Agg helper
 # ---------------------------------------------------------------------------
 
-def summarize_nday_agg(name, filename, block_size):
+def summarize_nday_agg(cur, out, name, filename, block_size):
     p = DB_DIR / filename
     if not p.exists():
-        section(f"{name} — not found"); return
-    section(name)
-    print_schema(f"read_parquet('{p}')")
-
-    total = q1(f"SELECT COUNT(*) FROM read_parquet('{p}')")
-    tickers = q1(f"SELECT COUNT(DISTINCT ticker) FROM read_parquet('{p}')")
-    date_range = q(f"SELECT MIN(block_start), MAX(block_end) FROM read_parquet('{p}')")[0]
-    print(f"  Rows: {fmt(total)} | Tickers: {fmt(tickers)} | Range: {date_range[0]} to {date_range[1]}")
-    print(f"  File: {file_size(p)}")
-
-    dc_stats = q(f"""
-        SELECT MIN(day_cnt), MEDIAN(day_cnt)::INT, MAX(day_cnt), ROUND(AVG(day_cnt), 1)
-        FROM read_parquet('{p}')
+        section(out, f"{name} — not found"); return
+    section(out, name)
+    print_schema(cur, out, p)
+    view = p.stem
+    register_view(cur, view, p)
+
+    # Not partitioned: totals, range and block-length stats come from one scan
+    total, tickers, range_start, range_end, *dc_stats = q(cur, f"""
+        SELECT COUNT(*), approx_count_distinct(ticker), MIN(block_start), MAX(block_end),
+               MIN(day_cnt), MEDIAN(day_cnt)::INT, MAX(day_cnt), ROUND(AVG(day_cnt), 1)
+        FROM {view}
     """)[0]
-    print(f"  Days per block — min: {dc_stats[0]}, median: {dc_stats[1]}, max: {dc_stats[2]}, avg: {dc_stats[3]} (expect <={block_size})")
+    print(f"  Rows: {fmt_int(total)} | Tickers: {fmt_int(tickers)} | Range: {range_start} to {range_end}", file=out)
+    print(f"  File: {file_size(p)}", file=out)
+    print(f"  Days per block — min: {dc_stats[0]}, median: {dc_stats[1]}, max: {dc_stats[2]}, avg: {dc_stats[3]} (expect <={block_size})", file=out)
 
-    sample = q(f"""
+    sample = q(cur, f"""
         SELECT ticker, block_start, block_end, open, close, volume, day_cnt
-        FROM read_parquet('{p}') USING SAMPLE 5
+        FROM {view} LIMIT 5
     """)
-    print(f"\n  Sample rows:")
-    for t, bs, be, o, c, v, dc in sample:
-        print(f"    {t:>6} | {bs} to {be} | O:{o:.2f} C:{c:.2f} | V:{fmt(v)} | {dc} days")
+    print(f"\n  Sample rows:", file=out)
+    out.write("".join(
+        f"    {t:>6} | {bs} to {be} | O:{o:.2f} C:{c:.2f} | V:{fmt(v)} | {dc} days\n"
+        for t, bs, be, o, c, v, dc in sample
+    ))
 
 
 # ---------------------------------------------------------------------------
 # Market Cap
 # ---------------------------------------------------------------------------
 
-def summarize_market_cap():
+def summarize_market_cap(cur, out):
     p = DB_DIR / "market_cap.parquet"
     if not p.exists():
-        section("MARKET CAP — not found"); return
-    section("MARKET CAP")
-    print_schema(f"read_parquet('{p}')")
-
-    total = q1(f"SELECT COUNT(*) FROM read_parquet('{p}')")
-    tickers = q1(f"SELECT COUNT(DISTINCT ticker) FROM read_parquet('{p}')")
-    date_range = q(f"SELECT MIN(day), MAX(day) FROM read_parquet('{p}')")[0]
-    print(f"  Rows: {fmt(total)} | Tickers: {fmt(tickers)} | Dates: {date_range[0]} to {date_range[1]}")
-    print(f"  File: {file_size(p)}")
-
-    cap_stats = q(f"""
+        section(out, "MARKET CAP — not found"); return
+    section(out, "MARKET CAP")
+    print_schema(cur, out, p)
+    register_view(cur, "market_cap", p)
+
+    total = footer_rows(cur, p)
+    tickers = q1(cur, "SELECT approx_count_distinct(ticker) FROM market_cap")
+    date_range = footer_range(cur, p, "day")
+    print(f"  Rows: {fmt_int(total)} | Tickers: {fmt_int(tickers)} | Dates: {date_range[0]} to {date_range[1]}", file=out)
+    print(f"  File: {file_size(p)}", file=out)
+
+    cap_stats = q(cur, """
         SELECT MIN(cap), MEDIAN(cap)::BIGINT, MAX(cap)
-        FROM read_parquet('{p}')
+        FROM market_cap
     """)[0]
-    print(f"  Cap range — min: ${fmt(cap_stats[0])}  median: ${fmt(cap_stats[1])}  max: ${fmt(cap_stats[2])}")
+    print(f"  Cap range — min: ${fmt(cap_stats[0])}  median: ${fmt(cap_stats[1])}  max: ${fmt(cap_stats[2])}", file=out)
 
-    top = q(f"""
-        WITH latest AS (
-            SELECT ticker, cap, ROW_NUMBER() OVER (PARTITION BY ticker ORDER BY day DESC) as rn
-            FROM read_parquet('{p}')
-        )
-        SELECT ticker, cap FROM latest WHERE rn = 1
+    top = q(cur, """
+        SELECT ticker, arg_max(cap, day) AS cap
+        FROM market_cap
+        GROUP BY ticker
         ORDER BY cap DESC LIMIT 10
     """)
-    print(f"\n  Top 10 by latest market cap:")
-    for t, c in top:
-        print(f"    {t:>6}  ${fmt(c)}")
+    print(f"\n  Top 10 by latest market cap:", file=out)
+    out.write("".join(
+        f"    {t:>6}  ${fmt_int(c)}\n"
+        for t, c in top
+    ))
 
 
 # ---------------------------------------------------------------------------
 # Insider Trades
 # ---------------------------------------------------------------------------
 
-def summarize_insider_trades():
+def summarize_insider_trades(cur, out):
     p = DB_DIR / "insider_trades.parquet"
     if not p.exists():
-        section("INSIDER TRADES — not found"); return
-    section("INSIDER TRADES")
-    print_schema(f"read_parquet('{p}')")
-
-    total = q1(f"SELECT COUNT(*) FROM read_parquet('{p}')")
-    tickers = q1(f"SELECT COUNT(DISTINCT ticker) FROM read_parquet('{p}')")
-    date_range = q(f"SELECT MIN(trade_date), MAX(trade_date) FROM read_parquet('{p}')")[0]
-    print(f"  Rows: {fmt(total)} | Tickers: {fmt(tickers)} | Dates: {date_range[0]} to {date_range[1]}")
-    print(f"  File: {file_size(p)}")
-
-    tx_codes = q(f"""
-        SELECT tx_code, COUNT(*) FROM read_parquet('{p}')
+        section(out, "INSIDER TRADES — not found"); return
+    section(out, "INSIDER TRADES")
+    print_schema(cur, out, p)
+    register_view(cur, "insider_trades", p)
+
+    total = footer_rows(cur, p)
+    tickers = q1(cur, "SELECT approx_count_distinct(ticker) FROM insider_trades")
+    date_range = footer_range(cur, p, "trade_date")
+    print(f"  Rows: {fmt_int(total)} | Tickers: {fmt_int(tickers)} | Dates: {date_range[0]} to {date_range[1]}", file=out)
+    print(f"  File: {file_size(p)}", file=out)
+
+    tx_codes = q(cur, """
+        SELECT tx_code, COUNT(*) FROM insider_trades
         GROUP BY tx_code ORDER BY tx_code
     """)
-    print(f"  Transaction types: {', '.join(f'{c}={fmt(n)}' for c, n in tx_codes)}")
+    print(f"  Transaction types: {', '.join(f'{c}={fmt_int(n)}' for c, n in tx_codes)}", file=out)
 
-    ad = q(f"""
-        SELECT acquired_disposed, COUNT(*) FROM read_parquet('{p}')
+    ad = q(cur, """
+        SELECT acquired_disposed, COUNT(*) FROM insider_trades
         GROUP BY acquired_disposed ORDER BY acquired_disposed
     """)
-    print(f"  Acquired/Disposed: {', '.join(f'{c}={fmt(n)}' for c, n in ad)}")
+    print(f"  Acquired/Disposed: {', '.join(f'{c}={fmt_int(n)}' for c, n in ad)}", file=out)
 
-    own = q(f"""
-        SELECT ownership_type, COUNT(*) FROM read_parquet('{p}')
+    own = q(cur, """
+        SELECT ownership_type, COUNT(*) FROM insider_trades
         GROUP BY ownership_type ORDER BY ownership_type
     """)
-    print(f"  Ownership type: {', '.join(f'{c}={fmt(n)}' for c, n in own)}")
+    print(f"  Ownership type: {', '.join(f'{c}={fmt_int(n)}' for c, n in own)}", file=out)
 
-    top = q(f"""
-        SELECT ticker, COUNT(*) as trades FROM read_parquet('{p}')
+    top = q(cur, """
+        SELECT ticker, COUNT(*) as trades FROM insider_trades
         GROUP BY ticker ORDER BY trades DESC LIMIT 10
     """)
-    print(f"\n  Top 10 most-traded tickers:")
-    for t, n in top:
-        print(f"    {t:>6}  {fmt(n)} trades")
-
-    sample = q(f"""
-        SELECT ticker, trade_date, tx_code, shares, total_value, insider_name
-        FROM read_parquet('{p}') USING SAMPLE 5
+    print(f"\n  Top 10 most-traded tickers:", file=out)
+    out.write("".join(
+        f"    {t:>6}  {fmt_int(n)} trades\n"
+        for t, n in top
+    ))
+
+    sample = q(cur, """
+        SELECT ticker, trade_date, tx_code, shares, total_value,
+               CASE WHEN length(insider_name) > 30 THEN left(insider_name, 30) || '...'
+                    ELSE COALESCE(NULLIF(insider_name, ''), 'N/A') END
+        FROM insider_trades LIMIT 5
     """)
-    print(f"\n  Sample rows:")
-    for t, d, tc, s, tv, name in sample:
-        tv_str = f"${fmt(tv)}" if tv else "N/A"
-        name_str = (name[:30] + "...") if name and len(name) > 30 else (name or "N/A")
-        print(f"    {t:>6} | {d} | {tc} | {fmt(s)} shares | {tv_str} | {name_str}")
+    print(f"\n  Sample rows:", file=out)
+    out.write("".join(
+        f"    {t:>6} | {d} | {tc} | {fmt(s)} shares | {f'${fmt_float(tv)}' if tv else 'N/A'} | {name}\n"
+        for t, d, tc, s, tv, name in sample
+    ))
 
 
 # ---------------------------------------------------------------------------
 # Daily Aggs Enriched
 # ---------------------------------------------------------------------------
 
-def summarize_daily_aggs_enriched():
+def summarize_daily_aggs_enriched(cur, out):
     d = DB_DIR / "daily_aggs_enriched"
     if not d.exists():
-        section("DAILY AGGS ENRICHED — not found"); return
-    section("DAILY AGGS ENRICHED")
-    pp = str(d / "**" / "*.parquet")
-    print_schema(f"read_parquet('{pp}', hive_partitioning=true)")
+        section(out, "DAILY AGGS ENRICHED — not found"); return
+    section(out, "DAILY AGGS ENRICHED")
+    print_schema(cur, out, d, hive=True)
+    register_view(cur, "daily_aggs_enriched", d, hive=True)
 
-    total = q1(f"SELECT COUNT(*) FROM read_parquet('{pp}', hive_partitioning=true)")
-    tickers = q1(f"SELECT COUNT(DISTINCT ticker) FROM read_parquet('{pp}', hive_partitioning=true)")
-    date_range = q(f"SELECT MIN(day), MAX(day) FROM read_parquet('{pp}', hive_partitioning=true)")[0]
-    print(f"  Rows: {fmt(total)} | Tickers: {fmt(tickers)} | Dates: {date_range[0]} to {date_range[1]}")
-    print(f"  Total size: {file_size(d)}")
+    (_, total, tickers, min_day, max_day), per_year = rollup_by_year(
+        cur, "daily_aggs_enriched", ", MIN(day), MAX(day)"
+    )
+    print(f"  Rows: {fmt_int(total)} | Tickers: {fmt_int(tickers)} | Dates: {min_day} to {max_day}", file=out)
+    sizes, total_bytes = dir_size_by_child(d)
+    print(f"  Total size: {human_size(total_bytes)}", file=out)
 
-    cap_coverage = q(f"""
+    cap_coverage = q(cur, """
         SELECT
             COUNT(*) FILTER (WHERE cap IS NOT NULL) AS with_cap,
             COUNT(*) AS total
-        FROM read_parquet('{pp}', hive_partitioning=true)
+        FROM daily_aggs_enriched
     """)[0]
     pct = (cap_coverage[0] / cap_coverage[1] * 100) if cap_coverage[1] else 0
-    print(f"  Market cap coverage: {fmt(cap_coverage[0])} / {fmt(cap_coverage[1])} rows ({pct:.1f}%)")
+    print(f"  Market cap coverage: {fmt_int(cap_coverage[0])} / {fmt_int(cap_coverage[1])} rows ({pct:.1f}%)", file=out)
 
-    days_per_ticker = q(f"""
+    days_per_ticker = q(cur, """
         SELECT MIN(days), MEDIAN(days)::INT, MAX(days)
-        FROM (SELECT COUNT(*) as days FROM read_parquet('{pp}', hive_partitioning=true) GROUP BY ticker)
+        FROM (SELECT COUNT(*) as days FROM daily_aggs_enriched GROUP BY ticker)
     """)[0]
-    print(f"  Days per ticker — min: {fmt(days_per_ticker[0])}, median: {fmt(days_per_ticker[1])}, max: {fmt(days_per_ticker[2])}")
-
-    print(f"\n  {'Year':>6} {'Rows':>14} {'Tickers':>9} {'Size':>8}")
-    print(f"  {'-'*41}")
-    per_year = q(f"""
-        SELECT year, COUNT(*) as rows, COUNT(DISTINCT ticker) as tickers
-        FROM read_parquet('{pp}', hive_partitioning=true)
-        GROUP BY year ORDER BY year
-    """)
-    for yr, rows, tkrs in per_year:
-        yr_dir = d / f"year={yr}"
-        sz = file_size(yr_dir)
-        print(f"  {yr:>6} {fmt(rows):>14} {fmt(tkrs):>9} {sz:>8}")
+    print(f"  Days per ticker — min: {fmt(days_per_ticker[0])}, median: {fmt(days_per_ticker[1])}, max: {fmt(days_per_ticker[2])}", file=out)
+
+    print_year_table(out, per_year, sizes)
 
-    sample = q(f"""
+    sample = q(cur, """
         SELECT ticker, day, open, close, volume, cap, trading_day_num,
                ROUND(cum_close, 2), ROUND(cum_volume, 0)
-        FROM read_parquet('{pp}', hive_partitioning=true) USING SAMPLE 5
+        FROM daily_aggs_enriched LIMIT 5
     """)
-    print(f"\n  Sample rows:")
-    for t, d_, o, c, v, cap, tdn, cc, cv in sample:
-        cap_str = f"${fmt(cap)}" if cap else "N/A"
-        print(f"    {t:>6} | {d_} | O:{o:.2f} C:{c:.2f} | V:{fmt(v)} | cap:{cap_str} | day#{tdn} | cum_c:{fmt(cc)} cum_v:{fmt(cv)}")
+    print(f"\n  Sample rows:", file=out)
+    out.write("".join(
+        f"    {t:>6} | {d_} | O:{o:.2f} C:{c:.2f} | V:{fmt(v)} | cap:{f'${fmt_int(cap)}' if cap else 'N/A'} | day#{tdn} | cum_c:{fmt_float(cc)} cum_v:{fmt(cv)}\n"
+        for t, d_, o, c, v, cap, tdn, cc, cv in sample
+    ))
 
 
 # ---------------------------------------------------------------------------
 # Insider Purchases
 # ---------------------------------------------------------------------------
 
-def summarize_insider_purchases():
+def summarize_insider_purchases(cur, out):
     d = DB_DIR / "insider_purchases"
     if not d.exists():
-        section("INSIDER PURCHASES — not found"); return
-    section("INSIDER PURCHASES")
+        section(out, "INSIDER PURCHASES — not found"); return
+    section(out, "INSIDER PURCHASES")
     pp = str(d / "**" / "*.parquet")
-    print_schema(f"read_parquet('{pp}', hive_partitioning=true)")
+    print_schema(cur, out, d, hive=True)
+    register_view(cur, "insider_purchases", d, hive=True)
 
-    total = q1(f"SELECT COUNT(*) FROM read_parquet('{pp}', hive_partitioning=true)")
-    tickers = q1(f"SELECT COUNT(DISTINCT ticker) FROM read_parquet('{pp}', hive_partitioning=true)")
-    date_range = q(f"SELECT MIN(filing_date), MAX(filing_date) FROM read_parquet('{pp}', hive_partitioning=true)")[0]
-    print(f"  Rows: {fmt(total)} | Tickers: {fmt(tickers)} | Dates: {date_range[0]} to {date_range[1]}")
-    print(f"  Total size: {file_size(d)}")
+    total = footer_rows(cur, pp)
+    tickers = q1(cur, "SELECT approx_count_distinct(ticker) FROM insider_purchases")
+    date_range = footer_range(cur, pp, "filing_date")
+    print(f"  Rows: {fmt_int(total)} | Tickers: {fmt_int(tickers)} | Dates: {date_range[0]} to {date_range[1]}", file=out)
+    print(f"  Total size: {file_size(d)}", file=out)
 
-    insiders = q1(f"SELECT COUNT(DISTINCT insider_cik) FROM read_parquet('{pp}', hive_partitioning=true)")
-    print(f"  Unique insiders: {fmt(insiders)}")
+    insiders = q1(cur, "SELECT COUNT(DISTINCT insider_cik) FROM insider_purchases")
+    print(f"  Unique insiders: {fmt_int(insiders)}", file=out)
 
-    role = q(f"""
+    role = q(cur, """
         SELECT
             COUNT(*) FILTER (WHERE is_director) AS directors,
             COUNT(*) FILTER (WHERE is_officer) AS officers,
             COUNT(*) FILTER (WHERE is_ten_pct_owner) AS ten_pct
-        FROM read_parquet('{pp}', hive_partitioning=true)
+        FROM insider_purchases
     """)[0]
-    print(f"  Role breakdown — directors: {fmt(role[0])}, officers: {fmt(role[1])}, 10%+ owners: {fmt(role[2])}")
+    print(f"  Role breakdown — directors: {fmt_int(role[0])}, officers: {fmt_int(role[1])}, 10%+ owners: {fmt_int(role[2])}", file=out)
 
-    top = q(f"""
-        SELECT ticker, COUNT(*) as purchases FROM read_parquet('{pp}', hive_partitioning=true)
+    top = q(cur, """
+        SELECT ticker, COUNT(*) as purchases FROM insider_purchases
         GROUP BY ticker ORDER BY purchases DESC LIMIT 10
     """)
-    print(f"\n  Top 10 most-purchased tickers:")
-    for t, n in top:
-        print(f"    {t:>6}  {fmt(n)} purchases")
-
-    sample = q(f"""
-        SELECT filing_date, ticker, shares, total_value, insider_name, trading_day_num
-        FROM read_parquet('{pp}', hive_partitioning=true) USING SAMPLE 5
+    print(f"\n  Top 10 most-purchased tickers:", file=out)
+    out.write("".join(
+        f"    {t:>6}  {fmt_int(n)} purchases\n"
+        for t, n in top
+    ))
+
+    sample = q(cur, """
+        SELECT filing_date, ticker, shares, total_value,
+               CASE WHEN length(insider_name) > 30 THEN left(insider_name, 30) || '...'
+                    ELSE COALESCE(NULLIF(insider_name, ''), 'N/A') END,
+               trading_day_num
+        FROM insider_purchases LIMIT 5
     """)
-    print(f"\n  Sample rows:")
-    for fd, t, s, tv, name, tdn in sample:
-        tv_str = f"${fmt(tv)}" if tv else "N/A"
-        name_str = (name[:30] + "...") if name and len(name) > 30 else (name or "N/A")
-        tdn_str = fmt(tdn) if tdn is not None else "N/A"
-        print(f"    {t:>6} | {fd} | {fmt(s)} shares | {tv_str} | tdn:{tdn_str} | {name_str}")
+    print(f"\n  Sample rows:", file=out)
+    out.write("".join(
+        f"    {t:>6} | {fd} | {fmt(s)} shares | {f'${fmt_float(tv)}' if tv else 'N/A'} | tdn:{fmt(tdn)} | {name}\n"
+        for fd, t, s, tv, name, tdn in sample
+    ))
 
 
 # ---------------------------------------------------------------------------
 # Trading Calendar
 # ---------------------------------------------------------------------------
 
-def summarize_trading_calendar():
+def summarize_trading_calendar(cur, out):
     p = DB_DIR / "trading_calendar.parquet"
     if not p.exists():
-        section("TRADING CALENDAR — not found"); return
-    section("TRADING CALENDAR")
-    print_schema(f"read_parquet('{p}')")
-
-    total = q1(f"SELECT COUNT(*) FROM read_parquet('{p}')")
-    date_range = q(f"SELECT MIN(day), MAX(day) FROM read_parquet('{p}')")[0]
-    tdn_range = q(f"SELECT MIN(trading_day_num), MAX(trading_day_num) FROM read_parquet('{p}')")[0]
-    print(f"  Trading days: {fmt(total)} | Range: {date_range[0]} to {date_range[1]}")
-    print(f"  trading_day_num range: {tdn_range[0]} to {tdn_range[1]}")
-    print(f"  File: {file_size(p)}")
-
-    per_year = q(f"""
+        section(out, "TRADING CALENDAR — not found"); return
+    section(out, "TRADING CALENDAR")
+    print_schema(cur, out, p)
+    register_view(cur, "trading_calendar", p)
+
+    total = footer_rows(cur, p)
+    date_range = footer_range(cur, p, "day")
+    tdn_range = footer_range(cur, p, "trading_day_num", "INTEGER")
+    print(f"  Trading days: {fmt_int(total)} | Range: {date_range[0]} to {date_range[1]}", file=out)
+    print(f"  trading_day_num range: {tdn_range[0]} to {tdn_range[1]}", file=out)
+    print(f"  File: {file_size(p)}", file=out)
+
+    per_year = q(cur, """
         SELECT YEAR(day) AS yr, COUNT(*) AS days,
                MIN(trading_day_num) AS min_tdn, MAX(trading_day_num) AS max_tdn
-        FROM read_parquet('{p}')
+        FROM trading_calendar
         GROUP BY yr ORDER BY yr
     """)
-    print(f"\n  {'Year':>6} {'Days':>6} {'TDN range':>14}")
-    print(f"  {'-'*30}")
+    print(f"\n  {'Year':>6} {'Days':>6} {'TDN range':>14}", file=out)
+    print(f"  {'-'*30}", file=out)
     for yr, days, min_tdn, max_tdn in per_year:
-        print(f"  {yr:>6} {days:>6} {min_tdn:>6}-{max_tdn:<6}")
+        print(f"  {yr:>6} {days:>6} {min_tdn:>6}-{max_tdn:<6}", file=out)
 
 
 # ---------------------------------------------------------------------------
 # Cap Lookup
 # ---------------------------------------------------------------------------
 
-def summarize_cap_lookup():
+def summarize_cap_lookup(cur, out):
     d = DB_DIR / "cap_lookup"
     if not d.exists():
-        section("CAP LOOKUP — not found"); return
-    section("CAP LOOKUP")
-    pp = str(d / "**" / "*.parquet")
-    print_schema(f"read_parquet('{pp}', hive_partitioning=true)")
+        section(out, "CAP LOOKUP — not found"); return
+    section(out, "CAP LOOKUP")
+    print_schema(cur, out, d, hive=True)
+    register_view(cur, "cap_lookup", d, hive=True)
 
-    total = q1(f"SELECT COUNT(*) FROM read_parquet('{pp}', hive_partitioning=true)")
-    tickers = q1(f"SELECT COUNT(DISTINCT ticker) FROM read_parquet('{pp}', hive_partitioning=true)")
-    date_range = q(f"SELECT MIN(day), MAX(day) FROM read_parquet('{pp}', hive_partitioning=true)")[0]
-    print(f"  Rows: {fmt(total)} | Tickers: {fmt(tickers)} | Dates: {date_range[0]} to {date_range[1]}")
-    print(f"  Total size: {file_size(d)}")
+    (_, total, tickers, min_day, max_day), per_year = rollup_by_year(
+        cur, "cap_lookup", ", MIN(day), MAX(day)"
+    )
+    print(f"  Rows: {fmt_int(total)} | Tickers: {fmt_int(tickers)} | Dates: {min_day} to {max_day}", file=out)
+    sizes, total_bytes = dir_size_by_child(d)
+    print(f"  Total size: {human_size(total_bytes)}", file=out)
 
-    cap_stats = q(f"""
+    cap_stats = q(cur, """
         SELECT MIN(cap), MEDIAN(cap)::BIGINT, MAX(cap)
-        FROM read_parquet('{pp}', hive_partitioning=true)
+        FROM cap_lookup
     """)[0]
-    print(f"  Cap range — min: ${fmt(cap_stats[0])}  median: ${fmt(cap_stats[1])}  max: ${fmt(cap_stats[2])}")
-
-    print(f"\n  {'Year':>6} {'Rows':>14} {'Tickers':>9} {'Size':>8}")
-    print(f"  {'-'*41}")
-    per_year = q(f"""
-        SELECT year, COUNT(*) as rows, COUNT(DISTINCT ticker) as tickers
-        FROM read_parquet('{pp}', hive_partitioning=true)
-        GROUP BY year ORDER BY year
-    """)
-    for yr, rows, tkrs in per_year:
-        yr_dir = d / f"year={yr}"
-        sz = file_size(yr_dir)
-        print(f"  {yr:>6} {fmt(rows):>14} {fmt(tkrs):>9} {sz:>8}")
+    print(f"  Cap range — min: ${fmt(cap_stats[0])}  median: ${fmt(cap_stats[1])}  max: ${fmt(cap_stats[2])}", file=out)
+
+    print_year_table(out, per_year, sizes)
 
-    sample = q(f"""
+    sample = q(cur, """
         SELECT day, ticker, cap, close, trading_day_num, ROUND(cum_close, 2)
-        FROM read_parquet('{pp}', hive_partitioning=true) USING SAMPLE 5
+        FROM cap_lookup LIMIT 5
     """)
-    print(f"\n  Sample rows:")
-    for d_, t, cap, c, tdn, cc in sample:
-        print(f"    {d_} | {t:>6} | cap:${fmt(cap)} | C:{c:.2f} | day#{tdn} | cum_c:{fmt(cc)}")
+    print(f"\n  Sample rows:", file=out)
+    out.write("".join(
+        f"    {d_} | {t:>6} | cap:${fmt(cap)} | C:{c:.2f} | day#{tdn} | cum_c:{fmt(cc)}\n"
+        for d_, t, cap, c, tdn, cc in sample
+    ))
 
 
 # ---------------------------------------------------------------------------
@@ -502,14 +664,34 @@ ALL_TABLES = {
 }
 
 
+def _summarize_to_text(summarize, share):
+    """Run one summarize_* on its own connection and return everything it printed.
+
+    The connection is closed as soon as the table is done, so hash tables and
+    cached footers from one table don't stay resident for the rest of the run.
+    """
+    out = io.StringIO()
+    with connect(share) as con:
+        summarize(con, out)
+    return out.getvalue()
+
+
 def run_summary(tables=None):
-    """Run summary for given tables (or all). Callable from other modules."""
+    """Run summary for given tables (or all). Callable from other modules.
+
+    Tables are summarized concurrently (one DuckDB connection per table); output
+    is printed in the requested order as each table finishes, one write and
+    flush per section so piped output isn't split into many small writes.
+    """
     tables = tables or list(ALL_TABLES.keys())
-    print(f"Database directory: {DB_DIR}")
-    print(f"Total DB size: {file_size(DB_DIR)}")
-    for t in tables:
-        ALL_TABLES[t]()
-    print()
+    _tree_sizes.cache_clear()  # sizes are walked once per run, then shared by all tables
+    sys.stdout.write(f"Database directory: {DB_DIR}\nTotal DB size: {file_size(DB_DIR)}\n")
+    sys.stdout.flush()
+    with ThreadPoolExecutor(max_workers=len(tables)) as pool:
+        futures = [pool.submit(_summarize_to_text, ALL_TABLES[t], len(tables)) for t in tables]
+        for i, future in enumerate(futures, 1):
+            sys.stdout.write(future.result() + ("\n" if i == len(futures) else ""))
+            sys.stdout.flush()
 
 
 def main():
@@ -530,7 +712,6 @@ def main():
             sys.exit(f"Unknown table: '{t}'. Choices: {', '.join(ALL_TABLES)}")
 
     run_summary(tables)
-    con.close()
 
 
 if __name__ == "__main__":
@@ -25,9 +25,9 @@ from pathlib import Path
 import steps  # noqa: F401 — triggers @step registration via auto-import
 
 from build_common import (
-    OUTPUT_DIR, _disabled_steps, _steps, cleanup_stale_artifacts,
+    OUTPUT_DIR, _disabled_steps, _steps, cleanup_stale_artifacts, clear_manifest,
     finalize_step_order, get_downstream_targets, load_manifest, log,
-    make_connection, save_manifest,
+    make_connection, record_step,
 )
 
 finalize_step_order()
@@ -51,10 +51,8 @@ def determine_steps_to_run(manifest, requested_targets, full_rebuild,
         return [(sid, tgt, fn) for sid, tgt, _, fn in _steps if sid not in skip]
 
     # Determine targets that need rebuilding due to explicit request
-    force_targets = set()
-    for t in requested_targets:
-        force_targets.add(t)
-        force_targets.update(get_downstream_targets(t))
+    force_targets = set(requested_targets).union(
+        *(get_downstream_targets(t) for t in requested_targets))
 
     rebuilt_this_run = set()  # targets rebuilt in this execution
     to_run = []
@@ -110,6 +108,8 @@ def run_build(requested_targets, full_rebuild=False, dry_run=False,
 
     log(f"Running {len(steps_to_run)} step(s)...")
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    if full_rebuild:
+        clear_manifest()
 
     for step_id, target, func in steps_to_run:
         log(f"── Step: {step_id} (target={target}) ──")
@@ -125,11 +125,7 @@ def run_build(requested_targets, full_rebuild=False, dry_run=False,
             con.close()
 
         elapsed = time.time() - t0
-        manifest[step_id] = {
-            "completed_at": datetime.now().isoformat(),
-            "elapsed_seconds": round(elapsed, 1),
-        }
-        save_manifest(manifest)
+        record_step(step_id, datetime.now().isoformat(), round(elapsed, 1))
         log(f"  Done in {elapsed:.1f}s")
 
     log("Build complete.")
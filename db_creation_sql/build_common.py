@@ -10,7 +10,9 @@ import shutil
 import sqlite3
 import sys
 import zipfile
+from collections import deque
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 
 import duckdb
@@ -23,7 +25,8 @@ SCRIPT_DIR = Path(__file__).resolve().parent
 PROJECT_DIR = SCRIPT_DIR.parent
 DATA_SOURCES = PROJECT_DIR / "data_sources"
 OUTPUT_DIR = PROJECT_DIR / "db_sql"
-MANIFEST_FILE = OUTPUT_DIR / ".build_manifest.json"
+MANIFEST_DB = OUTPUT_DIR / ".build_manifest.db"
+MANIFEST_FILE = OUTPUT_DIR / ".build_manifest.json"  # legacy format, migrated on first open
 
 STOCKS_ZIP_DIR = DATA_SOURCES / "stocks" / "data"
 ETFS_ZIP_DIR = DATA_SOURCES / "etfs" / "data"
@@ -60,6 +63,7 @@ def log_progress(current, total, msg):
 _steps = []  # ordered list of (step_id, target, depends_on, func)
 _target_to_steps = {}  # target -> [step_id, ...]
 _disabled_steps = set()  # step_ids that are registered but skipped
+_downstream = {}  # target -> frozenset of transitive downstream targets (set by finalize_step_order)
 
 
 def step(step_id, target, depends_on=(), disabled=False):
@@ -71,6 +75,7 @@ def step(step_id, target, depends_on=(), disabled=False):
     def decorator(func):
         _steps.append((step_id, target, depends_on, func))
         _target_to_steps.setdefault(target, []).append(step_id)
+        get_dependency_graph.cache_clear()
         if disabled:
             _disabled_steps.add(step_id)
         return func
@@ -102,7 +107,6 @@ def finalize_step_order():
                 in_degree[i] += 1
 
     # Kahn's: seed with zero in-degree steps, preserving original order (stable)
-    from collections import deque
     queue = deque(i for i in range(n) if in_degree[i] == 0)
     ordered = []
 
@@ -124,9 +128,16 @@ def finalize_step_order():
     reordered = [_steps[i] for i in ordered]
     _steps[:] = reordered
 
+    # Precompute each target's transitive downstream closure once
+    graph = get_dependency_graph()
+    _downstream.clear()
+    for target in _target_to_steps:
+        _downstream[target] = frozenset(_walk_downstream(graph, target))
+
 
+@lru_cache(maxsize=1)
 def get_dependency_graph():
-    """Build target -> set of targets that depend on it."""
+    """Build target -> set of targets that depend on it (cached; cleared by @step)."""
     dependents = {}
     for _, target, deps, _ in _steps:
         for dep in deps:
@@ -134,13 +145,12 @@ def get_dependency_graph():
     return dependents
 
 
-def get_downstream_targets(target):
-    """Get all targets downstream of a given target (transitive)."""
-    graph = get_dependency_graph()
+def _walk_downstream(graph, target):
+    """BFS over the dependents graph from target (excluding target itself)."""
     visited = set()
-    queue = [target]
+    queue = deque([target])
     while queue:
-        t = queue.pop(0)
+        t = queue.popleft()
         if t in visited:
             continue
         visited.add(t)
@@ -150,24 +160,89 @@ def get_downstream_targets(target):
     return visited
 
 
+def get_downstream_targets(target):
+    """Get all targets downstream of a given target (transitive)."""
+    return _downstream.get(target, frozenset())
+
+
 # ---------------------------------------------------------------------------
 # Manifest
 # ---------------------------------------------------------------------------
 
+_manifest_cache = {"stamp": None, "data": None}  # load_manifest memo, keyed on DB (mtime_ns, size)
 
-def load_manifest():
+
+def _open_manifest():
+    """Open the manifest DB, creating it (and migrating a legacy JSON manifest) if needed."""
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(MANIFEST_DB))
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS steps (
+            step_id TEXT PRIMARY KEY,
+            completed_at TEXT NOT NULL,
+            elapsed_seconds REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
     if MANIFEST_FILE.exists():
         with open(MANIFEST_FILE) as f:
-            return json.load(f)
-    return {}
+            legacy = json.load(f)
+        conn.executemany(
+            "INSERT OR IGNORE INTO steps VALUES (?, ?, ?)",
+            [(sid, info["completed_at"], info["elapsed_seconds"]) for sid, info in legacy.items()],
+        )
+        conn.commit()
+        MANIFEST_FILE.unlink()
+    return conn
 
 
-def save_manifest(manifest):
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    tmp = Path(str(MANIFEST_FILE) + ".tmp")
-    with open(tmp, "w") as f:
-        json.dump(manifest, f, indent=2)
-    tmp.rename(MANIFEST_FILE)
+def _manifest_stamp():
+    """(mtime_ns, size) of the manifest DB, or None if it doesn't exist."""
+    try:
+        st = MANIFEST_DB.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def load_manifest():
+    """Return {step_id: {completed_at, elapsed_seconds}} for all completed steps.
+
+    The result is cached until the manifest DB changes on disk or is written
+    through record_step()/clear_manifest(); treat it as read-only.
+    """
+    if not MANIFEST_DB.exists() and not MANIFEST_FILE.exists():
+        return {}
+    stamp = _manifest_stamp()
+    if stamp is not None and stamp == _manifest_cache["stamp"]:
+        return _manifest_cache["data"]
+    conn = _open_manifest()
+    rows = conn.execute("SELECT step_id, completed_at, elapsed_seconds FROM steps").fetchall()
+    conn.close()
+    data = {sid: {"completed_at": completed_at, "elapsed_seconds": elapsed}
+            for sid, completed_at, elapsed in rows}
+    _manifest_cache["stamp"] = _manifest_stamp()
+    _manifest_cache["data"] = data
+    return data
+
+
+def record_step(step_id, completed_at, elapsed_seconds):
+    """Upsert one completed step — a single-row write, not a full manifest rewrite."""
+    conn = _open_manifest()
+    conn.execute("INSERT OR REPLACE INTO steps VALUES (?, ?, ?)",
+                 (step_id, completed_at, elapsed_seconds))
+    conn.commit()
+    conn.close()
+    _manifest_cache["stamp"] = None
+
+
+def clear_manifest():
+    """Forget all completed steps (used by --full)."""
+    conn = _open_manifest()
+    conn.execute("DELETE FROM steps")
+    conn.commit()
+    conn.close()
+    _manifest_cache["stamp"] = None
 
 
 # ---------------------------------------------------------------------------
@@ -65,10 +65,11 @@ def build_daily_aggs_enriched(con):
         SELECT
             ticker,
             CAST(ts AS DATE) AS day,
-            FIRST(open ORDER BY ts) AS open,
+            -- Wrapped in a struct so a NULL open/close is returned, not skipped (as FIRST/LAST did)
+            ARG_MIN({'v': open}, ts).v AS open,
             MAX(high) AS high,
             MIN(low) AS low,
-            LAST(close ORDER BY ts) AS close,
+            ARG_MAX({'v': close}, ts).v AS close,
             SUM(volume)::BIGINT AS volume
         FROM _all_prices
         GROUP BY ticker, CAST(ts AS DATE)
@@ -81,17 +82,22 @@ def build_daily_aggs_enriched(con):
 
     log("Loading market cap data...")
 
+    # Ticker is derived in a subquery so the filename split runs once per row,
+    # not again inside each WHERE predicate that references the alias
     con.execute(f"""
         CREATE TABLE _market_cap AS
-        SELECT
-            replace(string_split(filename, '/')[-1], '.csv', '') AS ticker,
-            CAST(date AS DATE) AS day,
-            CAST(market_cap AS BIGINT) AS cap
-        FROM read_csv(
-            '{csv_pattern}',
-            header=true,
-            columns={{'date': 'DATE', 'market_cap': 'BIGINT'}},
-            filename=true
+        SELECT ticker, day, cap
+        FROM (
+            SELECT
+                replace(string_split(filename, '/')[-1], '.csv', '') AS ticker,
+                CAST(date AS DATE) AS day,
+                CAST(market_cap AS BIGINT) AS cap
+            FROM read_csv(
+                '{csv_pattern}',
+                header=true,
+                columns={{'date': 'DATE', 'market_cap': 'BIGINT'}},
+                filename=true
+            )
         )
         WHERE ticker != ''
           AND ticker IN (SELECT ticker FROM sqlite_scan('{tickers_db}', 'tickers'))
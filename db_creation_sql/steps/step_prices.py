@@ -1,8 +1,9 @@
-"""Step 2: Extract ZIP archives and build per-year SQLite databases with hourly price data."""
+"""Step 2: Stream ZIP archives and build per-year SQLite databases with hourly price data."""
 
+import os
 import shutil
 import sqlite3
-import tempfile
+import threading
 import zipfile
 from pathlib import Path
 
@@ -18,13 +19,48 @@ from build_common import (
 
 # Parquet settings for temp intermediate files (DuckDB computation only)
 PARQUET_SETTINGS = "FORMAT PARQUET, COMPRESSION SNAPPY, ROW_GROUP_SIZE 122880"
+STREAM_BUFFER_SIZE = 1024 * 1024  # Pipe write buffer for streamed ZIP members
+
+
+def _ticker_members(zf):
+    """Return [(ticker, ZipInfo)] for every per-ticker price file in an open ZIP."""
+    members = []
+    for info in zf.infolist():
+        basename = info.filename.rsplit("/", 1)[-1]
+        if basename.endswith(TICKER_SUFFIX) and basename != TICKER_SUFFIX:
+            members.append((basename[:-len(TICKER_SUFFIX)], info))
+    return members
+
+
+def _stream_members(zf, members, write_fd, errors):
+    """
+    Writer thread for Pass 1: decompress each member straight from the ZIP's
+    central-directory entry and write its lines to the pipe, prefixed with
+    "{ticker}," so DuckDB reads the whole archive as one headerless CSV.
+    Exceptions are appended to `errors`.
+    """
+    try:
+        with os.fdopen(write_fd, "wb", buffering=STREAM_BUFFER_SIZE) as out:
+            for ticker, info in members:
+                with zf.open(info) as fh:
+                    data = fh.read()
+                data = data.rstrip(b"\r\n")
+                if not data:
+                    continue
+                prefix = ticker.encode() + b","
+                out.write(prefix + data.replace(b"\n", b"\n" + prefix) + b"\n")
+    except BrokenPipeError:
+        # Reader closed early (query error); the error is reported by the reader
+        pass
+    except Exception as e:
+        errors.append(e)
 
 
 @step("prices_v5", target="prices", depends_on=("tickers",))
 def build_prices(con):
     """
     Four-pass approach:
-    Pass 1: Extract each ZIP, read CSVs, write temp parquet partitioned by year
+    Pass 1: Stream each ZIP's CSVs into DuckDB, write temp parquet partitioned by year
     Pass 2: For each year, merge fragments, deduplicate, sort, write final temp parquet
     Pass 3: Compute global trading_day_num, write staging_calendar.db,
             enrich each year temp parquet with trading_day_num
@@ -49,34 +85,31 @@ def build_prices(con):
 
     log(f"Pass 1: Processing {total_zips} ZIP files into temp fragments...")
 
-    # Pass 1: Extract each ZIP, read all CSVs, partition by year into temp fragments
+    # Pass 1: Stream each ZIP's CSVs (no extraction), partition by year into temp fragments
     for zip_idx, (zip_path, asset_type) in enumerate(all_zips):
         log_progress(zip_idx + 1, total_zips, f"Processing {zip_path.name}")
 
-        with tempfile.TemporaryDirectory() as tmpdir:
-            # Extract ZIP
-            with zipfile.ZipFile(zip_path) as zf:
-                zf.extractall(tmpdir)
-
-            # Find all txt files
-            txt_files = list(Path(tmpdir).rglob("*.txt"))
-            if not txt_files:
+        with zipfile.ZipFile(zip_path) as zf:
+            members = _ticker_members(zf)
+            if not members:
                 log(f"  Warning: no .txt files in {zip_path.name}")
                 continue
 
-            # Use DuckDB to read all CSVs at once with filename-based ticker extraction
             zcon = duckdb.connect(":memory:")
             zcon.execute(f"SET memory_limit = '{DUCKDB_MEMORY_LIMIT}'")
             zcon.execute(f"SET threads = {DUCKDB_THREADS}")
 
-            # Read all txt files - they have no header
-            glob_pattern = str(Path(tmpdir) / "**" / "*.txt")
-            suffix_sql = TICKER_SUFFIX.replace("'", "''")
+            # Decompressed bytes go through a pipe instead of an extracted temp dir
+            read_fd, write_fd = os.pipe()
+            stream_errors = []
+            writer = threading.Thread(target=_stream_members, args=(zf, members, write_fd, stream_errors))
+            writer.start()
             try:
+                # Ticker is the first column, written by the streaming thread
                 zcon.execute(f"""
                     CREATE TABLE _raw AS
                     SELECT
-                        replace(string_split(filename, '/')[-1], '{suffix_sql}', '') AS ticker,
+                        ticker,
                         column0 AS ts,
                         column1 AS open,
                         column2 AS high,
@@ -85,9 +118,10 @@ def build_prices(con):
                         column5 AS volume,
                         '{asset_type}' AS _asset_type
                     FROM read_csv(
-                        '{glob_pattern}',
+                        '/dev/fd/{read_fd}',
                         header=false,
                         columns={{
+                            'ticker': 'VARCHAR',
                             'column0': 'TIMESTAMP',
                             'column1': 'FLOAT',
                             'column2': 'FLOAT',
@@ -95,13 +129,13 @@ def build_prices(con):
                             'column4': 'FLOAT',
                             'column5': 'INTEGER'
                         }},
-                        filename=true,
                         ignore_errors=true
                     )
-                    WHERE replace(string_split(filename, '/')[-1], '{suffix_sql}', '')
-                        != string_split(filename, '/')[-1]
-                      AND EXTRACT(HOUR FROM column0) BETWEEN {REGULAR_HOURS_START} AND {REGULAR_HOURS_END}
+                    WHERE EXTRACT(HOUR FROM column0) BETWEEN {REGULAR_HOURS_START} AND {REGULAR_HOURS_END}
                 """)
+                writer.join()
+                if stream_errors:
+                    raise stream_errors[0]
 
                 row_count = zcon.execute("SELECT COUNT(*) FROM _raw").fetchone()[0]
                 if row_count == 0:
@@ -132,6 +166,8 @@ def build_prices(con):
             except Exception as e:
                 log(f"  Error processing {zip_path.name}: {e}")
             finally:
+                os.close(read_fd)
+                writer.join()
                 zcon.close()
 
     # Pass 2: For each year, merge fragments, deduplicate, sort, write temp merged parquet
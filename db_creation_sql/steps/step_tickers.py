@@ -20,18 +20,11 @@ def build_tickers(con):
     etf_tickers = discover_tickers_from_zips(ETFS_ZIP_DIR)
     log(f"  Found {len(etf_tickers)} ETF tickers")
 
-    # Build rows: ETF wins on overlap
-    rows = []
-    all_tickers = sorted(set(stock_tickers) | set(etf_tickers))
-    overlap_count = 0
-    for ticker in all_tickers:
-        if ticker in etf_tickers:
-            asset_type = "etf"
-            if ticker in stock_tickers:
-                overlap_count += 1
-        else:
-            asset_type = "stock"
-        rows.append((ticker, asset_type))
+    # Build rows: ETF wins on overlap (whole-set operations, no per-ticker lookups)
+    etf_set = etf_tickers.keys()
+    stock_only = stock_tickers.keys() - etf_set
+    overlap_count = len(stock_tickers.keys() & etf_set)
+    rows = sorted([(t, "etf") for t in etf_set] + [(t, "stock") for t in stock_only])
 
     log(f"  Total: {len(rows)} tickers ({overlap_count} overlap, classified as ETF)")
 